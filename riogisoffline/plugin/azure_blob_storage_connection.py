@@ -1,11 +1,21 @@
 
 import json
 import riogisoffline.plugin.utils as utils
-from azure.storage.blob import BlobServiceClient, BlobBlock
+from .status_journal import StatusJournal
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient
+from .ranged_download import RangedDownload
+from .block_upload import BlockUpload, BlockUploadPipeline
+from .upload_ledger import UploadLedger
+from .upload_plan import PlannedFile, UploadPlan, UploadProgress
+from concurrent.futures import ThreadPoolExecutor
+import base64
+import datetime
 import os
-from pathlib import Path
+import time
 import uuid
-import pandas as pd
+from pathlib import Path
 
 class AzureBlobStorageConnection:
     """
@@ -44,7 +54,8 @@ class AzureBlobStorageConnection:
 
     def download_db(self, file_name, syncronizer):
         """
-        Download database-file
+        Download database-file. The ETag of each download is stored in a sync manifest
+        in the same folder, and the download is skipped if the blob is unchanged.
 
         Args:
             file_name (str): file name to save file as
@@ -52,21 +63,104 @@ class AzureBlobStorageConnection:
         """
         
         blob_client = self.blob_service_client.get_blob_client(container="offlinesecure", blob=f"latest/{utils.get_db_name()}")
-        download_stream = blob_client.download_blob()
-        download_chunks = download_stream.chunks()
+        properties = blob_client.get_blob_properties()
 
-        progress_percentage = 0
-        
-        with open(file=file_name, mode="wb") as blob:
-            for chunk in download_chunks:
-                progress_percentage += (len(chunk)/len(download_chunks))*100
-                syncronizer.signal_progress(progress_percentage)
+        manifest_path = utils.get_sync_manifest_path(os.path.dirname(file_name))
+        manifest = self._read_sync_manifest(manifest_path)
+        manifest_key = os.path.basename(file_name)
+
+        if self._is_unchanged_since_download(file_name, manifest.get(manifest_key), properties):
+            syncronizer.signal_info_message(f"{manifest_key} er uendret siden forrige synkronisering")
+
+            # mark file as synced now
+            os.utime(file_name)
+            syncronizer.signal_progress(100)
+            return
+
+        def fetch_range(start, end):
+            # fail if blob is changed on the server while downloading
+            download_stream = blob_client.download_blob(
+                offset=start,
+                length=end - start + 1,
+                etag=properties.etag,
+                match_condition=MatchConditions.IfNotModified,
+            )
+            return download_stream.readall()
+
+        # resumes earlier download of the same blob, and verifies content MD5 before replacing file
+        download = RangedDownload(
+            fetch_range,
+            properties.size,
+            file_name,
+            syncronizer.signal_progress,
+            validator=properties.etag,
+            expected_md5=properties.content_settings.content_md5,
+        )
+        download.run()
 
-                blob.write(chunk)
-            
-        
         syncronizer.signal_progress(100)
 
+        content_md5 = self._content_md5(properties)
+
+        manifest[manifest_key] = {
+            "etag": properties.etag,
+            "last_modified": properties.last_modified.isoformat() if properties.last_modified else None,
+            "content_md5": content_md5,
+            "size": properties.size,
+        }
+        self._write_sync_manifest(manifest_path, manifest)
+
+    @staticmethod
+    def _content_md5(properties):
+        """
+        Get base64 encoded MD5 of blob content, if set on blob
+
+        Args:
+            properties (BlobProperties): blob properties
+
+        Returns:
+            str: base64 encoded MD5, or None
+        """
+        content_md5 = properties.content_settings.content_md5
+
+        if not content_md5:
+            return None
+
+        return base64.b64encode(content_md5).decode()
+
+    @staticmethod
+    def _is_unchanged_since_download(file_name, manifest_entry, properties):
+        """
+        Check if blob is unchanged since it was downloaded to file_name
+
+        Args:
+            file_name (str): path to downloaded file
+            manifest_entry (dict): entry in sync manifest for file, or None
+            properties (BlobProperties): current properties of blob
+
+        Returns:
+            bool: True if file does not have to be downloaded again
+        """
+        if not manifest_entry or not os.path.exists(file_name):
+            return False
+
+        return manifest_entry.get("etag") == properties.etag and os.path.getsize(file_name) == properties.size
+
+    @staticmethod
+    def _read_sync_manifest(manifest_path):
+        if not os.path.exists(manifest_path):
+            return {}
+
+        try:
+            return utils.load_json(manifest_path)
+        except ValueError:
+            return {}
+
+    @staticmethod
+    def _write_sync_manifest(manifest_path, manifest):
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=4)
+
     def upload_projects(self, parent_dir_path, selected_projects, worker):
         """
         Upload content of directory containing WinCan-output directories
@@ -76,6 +170,82 @@ class AzureBlobStorageConnection:
             worker (Worker): worker running function
         """
 
+        # files that are already uploaded are skipped
+        ledger = UploadLedger(utils.get_upload_ledger_path())
+
+        worker.process_name.emit("Finner filer som skal lastes opp...")
+        plan = self.plan_upload(parent_dir_path, selected_projects, ledger, worker)
+
+        if not plan:
+            worker.finished.emit(True)
+            return
+
+        worker.info.emit(plan.summary())
+
+        for planned_file in plan.uploaded_files():
+            worker.info.emit(f" - Allerede lastet opp {planned_file.display_name()}")
+
+        files_to_upload = plan.files_to_upload()
+        progress = UploadProgress(plan.total_bytes(), len(files_to_upload))
+        last_progress_text_time = [0]
+
+        def _handle_progress(uploaded_bytes, _):
+            progress.update(uploaded_bytes)
+
+            # process name resets progress bar, so only update text every few seconds
+            if time.monotonic() - last_progress_text_time[0] > 2:
+                last_progress_text_time[0] = time.monotonic()
+                worker.process_name.emit(progress.text())
+
+            worker.progress.emit(progress.percent())
+
+        def _handle_block_staged(upload, index):
+            ledger.record_checkpoint(upload.filename, upload.blob_client.blob_name)
+
+        # files from all projects are uploaded concurrently
+        chunk_size=4*1024*1024
+        pipeline = BlockUploadPipeline(progress_callback=_handle_progress)
+
+        for planned_file in files_to_upload:
+
+            def _handle_uploaded(upload, text=f" - Lastet opp {planned_file.display_name()}"):
+                ledger.record(upload.filename, upload.blob_client.blob_name, upload.content_md5())
+                progress.file_done()
+                worker.info.emit(text)
+
+            upload = BlockUpload(planned_file.blob_client, planned_file.file_path, chunk_size)
+
+            # continue interrupted upload of file
+            if ledger.has_checkpoint(planned_file.file_path, planned_file.blob_client.blob_name):
+                upload.resume()
+                progress.add_resumed_bytes(upload.staged_bytes())
+
+            pipeline.add(upload, _handle_uploaded, _handle_block_staged)
+
+        worker.process_name.emit(progress.text())
+        worker.progress.emit(0)
+
+        try:
+            pipeline.run()
+        finally:
+            ledger.save()
+
+        worker.finished.emit(False)
+
+    def plan_upload(self, parent_dir_path, selected_projects, ledger, worker):
+        """
+        Find all files to upload in selected projects, and which of them are already uploaded
+
+        Args:
+            parent_dir_path (str): path to dir containing WinCan-output directories
+            selected_projects ([str]): names of project dirs to upload
+            ledger (UploadLedger): record of uploaded files
+            worker (Worker): worker running function
+
+        Returns:
+            UploadPlan: files to upload, or None if a project dir does not have the correct structure
+        """
+
         subdirs_to_upload = {
             "DB": "DB",
             "Document": "Misc/Docu",
@@ -85,6 +255,11 @@ class AzureBlobStorageConnection:
 
         projects_to_upload_full_path = [os.path.join(parent_dir_path, project) for project in selected_projects]
 
+        wincan_files_container_client = self.blob_service_client.get_container_client(container=self.wincan_files_container_name)
+        documents_container_client = self.blob_service_client.get_container_client(container=self.unprocessed_documents_container_name)
+
+        plan = UploadPlan()
+
         for dir_path in projects_to_upload_full_path:
 
             dir_name = os.path.split(dir_path)[-1]
@@ -99,23 +274,11 @@ class AzureBlobStorageConnection:
                 if not p.is_dir():
                     worker.warning.emit(f"ERROR: '{subdir_path}' does not exist in dir: '{dir_path}'")
                     worker.warning.emit(f"Mappen du valgte har ikke riktig mappestruktur. Sjekk om du har valgt riktig mappe.")
-                    worker.finished.emit(True)
-                    return
-
-            # upload to azure
-            chunk_size=4*1024*1024
-            wincan_files_container_client = self.blob_service_client.get_container_client(container=self.wincan_files_container_name)
-            documents_container_client = self.blob_service_client.get_container_client(container=self.unprocessed_documents_container_name)
-
-            # TODO: show how many files will be uploaded and show how many are left
+                    return None
             
             for subdir_to_upload_name, subdir_path in subdirs_to_upload.items():
                 for fullsubdirpath, _, filenames in os.walk(os.path.join(os.path.join(dir_path, subdir_path))):
                     for filename in filenames:
-                        worker.process_name.emit(f"{dir_name}/{subdir_to_upload_name}/{filename}")
-                        worker.progress.emit(0)
-
-                        block_list = []
 
                         # skips upload if txt-file
                         if ".txt" in filename:
@@ -127,77 +290,129 @@ class AzureBlobStorageConnection:
                         else:
                             full_path = os.path.join("tt", subdir_to_upload_name, filename)
                             blob_client = documents_container_client.get_blob_client(full_path)
-                        chunk_num = 0
 
-                        with  open(file=os.path.join(fullsubdirpath, filename), mode="rb") as  f:
-                            while  True:
+                        file_path = os.path.join(fullsubdirpath, filename)
+                        is_uploaded = self._is_uploaded(ledger, file_path, blob_client)
 
-                                chunk_num += 1
-                                read_data = f.read(chunk_size)
-                                if  not  read_data:
-                                    break  # done
-                                blk_id = str(uuid.uuid4())
-                                blob_client.stage_block(block_id=blk_id,data=read_data)
-                                block_list.append(BlobBlock(block_id=blk_id))
-                                blob_client.commit_block_list(block_list)
-                                
-                                progress = int((chunk_size*chunk_num)/os.path.getsize(os.path.join(fullsubdirpath, filename))*100)
-                                worker.progress.emit(min(progress, 100))
+                        plan.add(PlannedFile(dir_name, subdir_to_upload_name, file_path, blob_client, is_uploaded))
 
+        return plan
 
-                        worker.info.emit(f" - Lastet opp {dir_name}/{subdir_to_upload_name}/{filename}")
-            
+    def _is_uploaded(self, ledger, file_path, blob_client):
+        """
+        Check if file is already uploaded to blob, and is unchanged since then
 
-        worker.finished.emit(False)
+        Args:
+            ledger (UploadLedger): record of uploaded files
+            file_path (str): path to local file
+            blob_client (BlobClient): client of blob to upload to
+
+        Returns:
+            bool: True if blob exists with the MD5 of the file
+        """
+        content_md5 = ledger.content_md5(file_path, blob_client.blob_name)
+
+        if not content_md5:
+            return False
+
+        try:
+            properties = blob_client.get_blob_properties()
+        except ResourceNotFoundError:
+            return False
+
+        return self._content_md5(properties) == content_md5
 
     def upload_status_changes(self, settings):
+        """
+        Upload status changes made offline, and remove the uploaded changes from the journal.
+        Each change is uploaded as a json-blob, or all changes as one NDJSON-blob if
+        setting "status_upload_batch" is true.
 
-        status_change_files = {
-            "changed_status_filename": ["lsid", "new_status", "comment", "project_area_id"],
-            "changed_project_status_filename": ["GlobalID", "new_status", "comments_inspector"]
-        }
+        Args:
+            settings (dict): settings
+        """
 
-        user_settings = utils.get_user_settings_path()
-        # read user settings
-        user_settings = utils.load_json(user_settings)
-        file_folder_path = user_settings["file_folder"]
+        journal = utils.get_status_journal(settings["file_folder"], settings)
 
-        for file, fields in status_change_files.items():
-        
-            changed_status_filename = os.path.join(file_folder_path, settings[file])
+        container_client = self.blob_service_client.get_container_client(container=self.wincan_files_container_name)
 
-            if not os.path.exists(changed_status_filename):
-                return
+        for table in [StatusJournal.ORDER_STATUS, StatusJournal.PROJECT_STATUS]:
 
-            changed_status_df = pd.read_csv(changed_status_filename)
-            changed_status_df.apply(lambda x: self._upload_status_file(x, fields), axis=1)
+            journal_changes = journal.changes(table)
 
-            os.remove(changed_status_filename)
+            if not journal_changes:
+                continue
 
-    def _upload_status_file(self, row, fields):
+            status_changes = [status_change for _, status_change in journal_changes]
+            row_id = StatusJournal.FIELDS[table][0]
 
-        row_id = fields[0]
+            if settings.get("status_upload_batch"):
+                self._upload_status_batch(container_client, status_changes, row_id)
+            else:
+                self._upload_status_files(container_client, status_changes, row_id)
 
-        if row[row_id] == row_id:
-            return
+            # changes made during upload are kept
+            last_uploaded_seq = journal_changes[-1][0]
+            journal.remove(table, last_uploaded_seq)
 
-        status_change_dict = {}
+    def _status_change_folder(self, row_id, batch=False):
+        """
+        Get folder to upload status changes to
 
-        for field in fields:
-            if field not in row:
-                utils.printWarningMessage(f"FEIL: Kolonne '{field}' finnes ikke i " + str(row))
-                return
-            
-            status_change_dict[field] = row[field]
+        Args:
+            row_id (str): field that identifies the changed feature
+            batch (bool, optional): True for NDJSON-batches, which are kept apart from json-blobs so that only consumers that read batches see them. Defaults to False.
 
-        json_object = json.dumps(status_change_dict, indent=4)
+        Returns:
+            str: folder
+        """
+        folder = "changed_status" if row_id == "lsid" else "changed_project_status"
 
-        if row_id == "lsid":
-            new_azure_path = os.path.join(self.env, "changed_status", f"{status_change_dict[row_id]}_status_change.json")
-        else:
-            new_azure_path = os.path.join(self.env, "changed_project_status", f"{status_change_dict[row_id]}_status_change.json")
+        if batch:
+            folder += "_batch"
 
-        container_client = self.blob_service_client.get_container_client(container=self.wincan_files_container_name)
-        blob_client = container_client.get_blob_client(new_azure_path)
+        return os.path.join(self.env, folder)
+
+    def _upload_status_files(self, container_client, status_changes, row_id, max_workers=8):
+        """
+        Upload one json-blob per changed feature, concurrently
+
+        Args:
+            container_client (ContainerClient): client of container to upload to
+            status_changes ([dict]): status changes, in the order they were made
+            row_id (str): field that identifies the changed feature
+            max_workers (int, optional): number of concurrent uploads. Defaults to 8.
+        """
+
+        # blobs are named by feature id, so only the last change of each feature is uploaded
+        latest_status_changes = {status_change[row_id]: status_change for status_change in status_changes}
+
+        def _upload(status_change):
+            json_object = json.dumps(status_change, indent=4)
+            new_azure_path = os.path.join(self._status_change_folder(row_id), f"{status_change[row_id]}_status_change.json")
+            container_client.get_blob_client(new_azure_path).upload_blob(json_object, overwrite=True)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # raises first exception from an upload
+            list(executor.map(_upload, latest_status_changes.values()))
+
+    def _upload_status_batch(self, container_client, status_changes, row_id):
+        """
+        Upload all status changes as one NDJSON-blob, one change per line
+
+        Args:
+            container_client (ContainerClient): client of container to upload to
+            status_changes ([dict]): status changes, in the order they were made
+            row_id (str): field that identifies the changed feature
+        """
+
+        if not status_changes:
+            return
+
+        ndjson = "\n".join(json.dumps(status_change) for status_change in status_changes) + "\n"
+
+        # uuid makes name unique, also for batches uploaded in the same second
+        timestamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+        new_azure_path = os.path.join(self._status_change_folder(row_id, batch=True), f"{timestamp}_{row_id}_{uuid.uuid4().hex}_status_changes.ndjson")
 
-        blob_client.upload_blob(json_object, overwrite=True)
\ No newline at end of file
+        container_client.get_blob_client(new_azure_path).upload_blob(ndjson, overwrite=False)
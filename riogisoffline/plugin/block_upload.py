@@ -0,0 +1,255 @@
+import base64
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobBlock, ContentSettings
+
+
+class BlockUpload:
+    """
+    Uploads a file to a block blob. The file is staged as blocks, and the block
+    list is committed once when all blocks are staged.
+
+    Block ids are derived from name, size and modification time of the file and
+    the index of the block, so uploading the same file again gives the same
+    block ids. Blocks staged by an interrupted upload of the same file can
+    therefore be found in the uncommitted block list of the blob, and are not
+    staged again. The MD5 of the file is computed while it is read, and set on
+    the blob when it is committed.
+
+    Attributes:
+    blob_client : BlobClient
+        client of blob to upload to
+    filename : str
+        path to file to upload
+    block_size : int
+        number of bytes in each block
+    """
+
+    def __init__(self, blob_client, filename, block_size=4*1024*1024):
+        self.blob_client = blob_client
+        self.filename = filename
+        self.block_size = block_size
+
+        stat = os.stat(filename)
+        self.size = stat.st_size
+
+        file_identity = f"{os.path.basename(filename)}:{stat.st_size}:{int(stat.st_mtime)}"
+        self._block_id_prefix = hashlib.md5(file_identity.encode("utf-8")).hexdigest()[:24]
+
+        self._md5 = hashlib.md5()
+        self.staged_indexes = set()
+
+    def block_id(self, index):
+        """
+        Get id of block. All ids of a file have the same length
+
+        Args:
+            index (int): index of block in file
+
+        Returns:
+            str: block id
+        """
+        return f"{self._block_id_prefix}-{index:08d}"
+
+    def block_count(self):
+        return (self.size + self.block_size - 1) // self.block_size
+
+    def block_length(self, index):
+        return min(self.block_size, self.size - index * self.block_size)
+
+    def resume(self):
+        """
+        Find blocks of file that are staged, but not committed, by an earlier upload
+        """
+        try:
+            _, uncommitted_blocks = self.blob_client.get_block_list("uncommitted")
+        except ResourceNotFoundError:
+            uncommitted_blocks = []
+
+        uncommitted_block_sizes = {block.id: block.size for block in uncommitted_blocks}
+
+        self.staged_indexes = {
+            index for index in range(self.block_count())
+            if uncommitted_block_sizes.get(self.block_id(index)) == self.block_length(index)
+        }
+
+    def staged_bytes(self):
+        return sum(self.block_length(index) for index in self.staged_indexes)
+
+    def is_staged(self, index):
+        return index in self.staged_indexes
+
+    def read_blocks(self):
+        """
+        Read file one block at a time
+
+        Yields:
+            (int, bytes): index and content of block
+        """
+        with open(self.filename, "rb") as f:
+            for index in range(self.block_count()):
+                data = f.read(self.block_size)
+                self._md5.update(data)
+                yield index, data
+
+    def content_md5(self):
+        """
+        Get MD5 of file. Only complete after all blocks are read
+
+        Returns:
+            str: base64 encoded MD5
+        """
+        return base64.b64encode(self._md5.digest()).decode()
+
+    def stage(self, index, data):
+        self.blob_client.stage_block(block_id=self.block_id(index), data=data)
+        self.staged_indexes.add(index)
+
+    def commit(self):
+        block_list = [BlobBlock(block_id=self.block_id(index)) for index in range(self.block_count())]
+        self.blob_client.commit_block_list(block_list, content_settings=ContentSettings(content_md5=bytearray(self._md5.digest())))
+
+
+class ByteBudget:
+    """
+    Limits the number of bytes in flight across threads
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        """
+        Wait until size bytes fit in the budget. A single item larger than the budget is let through when nothing else is in flight.
+
+        Args:
+            size (int): number of bytes
+        """
+        with self._condition:
+            while self._in_flight and self._in_flight + size > self.max_bytes:
+                self._condition.wait()
+            self._in_flight += size
+
+    def release(self, size):
+        with self._condition:
+            self._in_flight -= size
+            self._condition.notify_all()
+
+
+class BlockUploadPipeline:
+    """
+    Uploads several files concurrently. Files are read one block at a time, and
+    blocks from all files are staged by a shared thread pool. The number of
+    bytes read but not yet staged is limited, so memory use is bounded.
+
+    Attributes:
+    progress_callback : function
+        function(staged_bytes, total_bytes) called with total progress of all files when a block is staged
+    """
+
+    def __init__(self, max_workers=4, max_in_flight_bytes=64*1024*1024, progress_callback=None):
+        self.max_workers = max_workers
+        self.progress_callback = progress_callback
+
+        self._budget = ByteBudget(max_in_flight_bytes)
+        self._lock = threading.Lock()
+        self._uploads = []
+        self._remaining_blocks = {}
+        self._staged_bytes = 0
+        self._total_bytes = 0
+        self._exception = None
+
+    def add(self, upload, on_done=None, on_block_staged=None):
+        """
+        Add file to pipeline. Blocks that are already staged are not staged again
+
+        Args:
+            upload (BlockUpload): file upload
+            on_done (function, optional): function(upload) called when file is committed. Defaults to None.
+            on_block_staged (function, optional): function(upload, index) called when a block is staged. Defaults to None.
+        """
+        self._uploads.append((upload, on_done, on_block_staged))
+
+    def run(self):
+        """
+        Upload all added files
+
+        Raises:
+            Exception: first exception raised while staging or committing
+        """
+        self._total_bytes = sum(upload.size for upload, _, _ in self._uploads)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for upload, on_done, on_block_staged in self._uploads:
+                if self._exception:
+                    break
+
+                self._remaining_blocks[id(upload)] = upload.block_count()
+
+                if not upload.block_count():
+                    executor.submit(self._commit, upload, on_done)
+                    continue
+
+                for index, data in upload.read_blocks():
+                    if self._exception:
+                        break
+
+                    # staged by an earlier upload, but still read to compute MD5
+                    if upload.is_staged(index):
+                        self._block_done(upload, on_done, len(data))
+                        continue
+
+                    self._budget.acquire(len(data))
+                    executor.submit(self._stage_block, upload, on_done, on_block_staged, index, data)
+
+        if self._exception:
+            raise self._exception
+
+    def _stage_block(self, upload, on_done, on_block_staged, index, data):
+        try:
+            if not self._exception:
+                upload.stage(index, data)
+
+                if on_block_staged:
+                    on_block_staged(upload, index)
+        except Exception as e:
+            self._set_exception(e)
+        finally:
+            self._budget.release(len(data))
+
+        self._block_done(upload, on_done, len(data))
+
+    def _block_done(self, upload, on_done, length):
+        with self._lock:
+            self._staged_bytes += length
+            self._remaining_blocks[id(upload)] -= 1
+            is_last_block = self._remaining_blocks[id(upload)] == 0
+
+            if self.progress_callback:
+                self.progress_callback(self._staged_bytes, self._total_bytes)
+
+        if is_last_block:
+            self._commit(upload, on_done)
+
+    def _commit(self, upload, on_done):
+        if self._exception:
+            return
+
+        try:
+            upload.commit()
+
+            if on_done:
+                on_done(upload)
+        except Exception as e:
+            self._set_exception(e)
+
+    def _set_exception(self, exception):
+        with self._lock:
+            if not self._exception:
+                self._exception = exception
@@ -86,6 +86,8 @@ class ChangeStatusDialog(QtWidgets.QDialog, FORM_CLASS):
         layer.commitChanges()
         layer.triggerRepaint()
 
+        self.riogis.update_project_orders(selected_feature)
+
         if new_status == 2 or new_status == 4:
             self.riogis.update_project_to_in_progress(selected_feature)
 
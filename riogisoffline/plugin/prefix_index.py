@@ -0,0 +1,64 @@
+import bisect
+
+
+class PrefixIndex:
+    """
+    Sorted array of normalized keys, for finding values with a key starting with a prefix.
+    A lookup is a binary search, followed by a scan of the matching keys only.
+    """
+
+    def __init__(self, items=()):
+        """
+        Args:
+            items ([(object, object)], optional): (key, value) pairs. Defaults to ().
+        """
+        entries = sorted(
+            ((self.normalize(key), value) for key, value in items),
+            key=lambda entry: entry[0],
+        )
+
+        self._keys = [key for key, _ in entries]
+        self._values = [value for _, value in entries]
+
+    @staticmethod
+    def normalize(key):
+        return str(key).strip().lower()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key, value):
+        """
+        Add value, after values with the same key
+
+        Args:
+            key (object): key
+            value (object): value
+        """
+        key = self.normalize(key)
+        i = bisect.bisect_right(self._keys, key)
+
+        self._keys.insert(i, key)
+        self._values.insert(i, value)
+
+    def search(self, prefix, limit=None):
+        """
+        Get values with a key starting with prefix
+
+        Args:
+            prefix (str): start of key, case insensitive
+            limit (int, optional): max number of values. Defaults to None.
+
+        Returns:
+            [object]: values, sorted by key
+        """
+        prefix = self.normalize(prefix)
+        results = []
+
+        for i in range(bisect.bisect_left(self._keys, prefix), len(self._keys)):
+            if not self._keys[i].startswith(prefix) or (limit is not None and len(results) >= limit):
+                break
+
+            results.append(self._values[i])
+
+        return results
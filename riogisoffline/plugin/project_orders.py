@@ -0,0 +1,118 @@
+from qgis.core import QgsFeatureRequest
+
+
+class ProjectOrderIndex:
+    """
+    Maps project_area_id to the orders in the project, and keeps the total
+    length of the orders per status
+
+    Attributes:
+    layer : QgsVectorLayer
+        order layer ("Bestillinger")
+    """
+
+    # totals closer to zero than this (in meters) are rounding residue
+    LENGTH_TOLERANCE = 1e-6
+
+    def __init__(self, layer):
+        self.layer = layer
+
+        # fid -> (project_area_id, status, length)
+        self._orders = {}
+        # project_area_id -> set of fids
+        self._order_ids = {}
+        # project_area_id -> {status: total length}
+        self._length_totals = {}
+
+        request = QgsFeatureRequest()
+        request.setFlags(QgsFeatureRequest.NoGeometry)
+        request.setSubsetOfAttributes(["project_area_id", "status_internal", "length"], layer.fields())
+
+        for feature in layer.getFeatures(request):
+            self.update_order(feature)
+
+    def update_order(self, feature):
+        """
+        Add order to index, or update it if it is already indexed
+
+        Args:
+            feature (QgsFeature): order feature
+        """
+        self.remove_order(feature.id())
+
+        project_area_id = feature["project_area_id"]
+
+        # order is not part of a project
+        if not project_area_id:
+            return
+
+        status = feature["status_internal"] or None
+        length = feature["length"] or 0
+
+        self._orders[feature.id()] = (project_area_id, status, length)
+        self._order_ids.setdefault(project_area_id, set()).add(feature.id())
+
+        totals = self._length_totals.setdefault(project_area_id, {})
+        totals[status] = totals.get(status, 0) + length
+
+    def remove_order(self, fid):
+        """
+        Remove order from index
+
+        Args:
+            fid (int): feature id of order
+        """
+        if fid not in self._orders:
+            return
+
+        project_area_id, status, length = self._orders.pop(fid)
+        self._order_ids[project_area_id].discard(fid)
+
+        totals = self._length_totals[project_area_id]
+        totals[status] -= length
+
+        # subtracting floats leaves residue, e.g. -0.00 for a status without orders
+        if abs(totals[status]) < self.LENGTH_TOLERANCE:
+            del totals[status]
+
+    def order_ids(self, project_area_id):
+        """
+        Get feature ids of orders in project
+
+        Args:
+            project_area_id (str): id of project
+
+        Returns:
+            [int]: sorted feature ids
+        """
+        return sorted(self._order_ids.get(project_area_id, []))
+
+    def orders(self, project_area_id):
+        """
+        Get orders in project
+
+        Args:
+            project_area_id (str): id of project
+
+        Returns:
+            [QgsFeature]: order features
+        """
+        ids = self.order_ids(project_area_id)
+
+        if not ids:
+            return []
+
+        return list(self.layer.getFeatures(QgsFeatureRequest().setFilterFids(ids)))
+
+    def length_total(self, project_area_id, status):
+        """
+        Get total length of orders in project with given status
+
+        Args:
+            project_area_id (str): id of project
+            status (int): status_internal of orders
+
+        Returns:
+            float: total length in meters
+        """
+        return self._length_totals.get(project_area_id, {}).get(status, 0)
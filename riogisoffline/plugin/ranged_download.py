@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class RangedDownload:
+    """
+    Downloads a file as byte ranges that are fetched concurrently. Ranges are
+    written to their offset in a preallocated temporary file, which replaces
+    the target file when all ranges are downloaded and the checksum is correct.
+
+    Completed ranges are recorded in a checkpoint file next to the temporary
+    file, so an interrupted download only fetches the remaining ranges when it
+    is started again.
+
+    Attributes:
+    fetch_range : function
+        function(start, end) that returns the bytes from start to end (inclusive)
+    size : int
+        size of file in bytes
+    filename : str
+        path to save file as
+    progress_callback : function
+        function(progress) called with progress (0 to 100) when a range is downloaded
+    validator : str
+        ETag or last-modified time of remote file. A partial download is only resumed if it is unchanged
+    expected_md5 : bytes
+        MD5 digest of remote file. Only the size is checked if None
+    """
+
+    def __init__(self, fetch_range, size, filename, progress_callback=None, range_size=8*1024*1024, max_workers=4, validator=None, expected_md5=None):
+        self.fetch_range = fetch_range
+        self.size = size
+        self.filename = filename
+        self.temp_filename = filename + ".part"
+        self.checkpoint_filename = filename + ".part.json"
+        self.progress_callback = progress_callback
+        self.range_size = range_size
+        self.max_workers = max_workers
+        self.validator = validator
+        self.expected_md5 = expected_md5
+
+        self._lock = threading.Lock()
+        self._downloaded_bytes = 0
+        self._completed_ranges = set()
+
+    def ranges(self):
+        """
+        Split file into byte ranges
+
+        Returns:
+            [(int, int)]: list of (start, end), end inclusive
+        """
+        return [
+            (start, min(start + self.range_size, self.size) - 1)
+            for start in range(0, self.size, self.range_size)
+        ]
+
+    def run(self):
+        """
+        Download remaining ranges, verify file and move temporary file to filename
+
+        Raises:
+            IOError: if a range has the wrong length, or the downloaded file has the wrong checksum
+        """
+
+        if not self._resume():
+            self._completed_ranges = set()
+
+            # preallocate file so ranges can be written in any order
+            with open(self.temp_filename, "wb") as f:
+                f.truncate(self.size)
+
+            self._write_checkpoint()
+
+        remaining_ranges = [(start, end) for start, end in self.ranges() if start not in self._completed_ranges]
+        self._downloaded_bytes = self.size - sum(end - start + 1 for start, end in remaining_ranges)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self._download_range, start, end) for start, end in remaining_ranges]
+
+            for future in as_completed(futures):
+                exception = future.exception()
+
+                if exception:
+                    for f in futures:
+                        f.cancel()
+                    raise exception
+
+        if not self._is_valid():
+            self._remove_partial_download()
+            raise IOError(f"Downloaded file {self.filename} has wrong checksum")
+
+        os.replace(self.temp_filename, self.filename)
+        os.remove(self.checkpoint_filename)
+
+    def _resume(self):
+        """
+        Load checkpoint of earlier download of the same remote file
+
+        Returns:
+            bool: True if partial download can be resumed
+        """
+        if not os.path.exists(self.temp_filename) or not os.path.exists(self.checkpoint_filename):
+            return False
+
+        try:
+            with open(self.checkpoint_filename, "r") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        if checkpoint.get("size") != self.size or checkpoint.get("range_size") != self.range_size:
+            return False
+
+        if checkpoint.get("validator") != self.validator or os.path.getsize(self.temp_filename) != self.size:
+            return False
+
+        self._completed_ranges = set(checkpoint.get("completed_ranges", []))
+
+        return True
+
+    def _write_checkpoint(self):
+        checkpoint = {
+            "size": self.size,
+            "range_size": self.range_size,
+            "validator": self.validator,
+            "completed_ranges": sorted(self._completed_ranges),
+        }
+
+        temp_checkpoint_filename = self.checkpoint_filename + ".tmp"
+
+        with open(temp_checkpoint_filename, "w") as f:
+            json.dump(checkpoint, f)
+
+        os.replace(temp_checkpoint_filename, self.checkpoint_filename)
+
+    def _download_range(self, start, end):
+        data = self.fetch_range(start, end)
+
+        if len(data) != end - start + 1:
+            raise IOError(f"Expected {end - start + 1} bytes from range {start}-{end}, got {len(data)}")
+
+        with open(self.temp_filename, "r+b") as f:
+            f.seek(start)
+            f.write(data)
+
+            # range must be on disk before it is marked as completed
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._lock:
+            self._completed_ranges.add(start)
+            self._write_checkpoint()
+
+            self._downloaded_bytes += len(data)
+
+            if self.progress_callback:
+                self.progress_callback(self._downloaded_bytes / self.size * 100)
+
+    def _is_valid(self):
+        if os.path.getsize(self.temp_filename) != self.size:
+            return False
+
+        if not self.expected_md5:
+            return True
+
+        md5 = hashlib.md5()
+
+        with open(self.temp_filename, "rb") as f:
+            for block in iter(lambda: f.read(self.range_size), b""):
+                md5.update(block)
+
+        return md5.digest() == bytes(self.expected_md5)
+
+    def _remove_partial_download(self):
+        for filename in [self.temp_filename, self.checkpoint_filename]:
+            if os.path.exists(filename):
+                os.remove(filename)
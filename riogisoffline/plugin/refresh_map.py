@@ -1,10 +1,17 @@
+import hashlib
+import json
 import os
+import shutil
+import sqlite3
+from contextlib import closing
+from qgis.PyQt.QtCore import QTimer
 from qgis.PyQt.QtGui import QColor, QFont
 from qgis.core import (
     Qgis,
     QgsProject,
     QgsVectorLayer,
     QgsRuleBasedRenderer,
+    QgsRuleBasedLabeling,
     QgsSymbol,
     QgsCoordinateReferenceSystem,
     QgsPalLayerSettings,
@@ -20,9 +27,6 @@ from qgis.utils import iface
 import riogisoffline.plugin.utils as utils
 
 
-bg_filepath = os.getenv('BACKGROUND_MAP')
-source_filepath = os.getenv('SOURCE_MAP')
-
 DEFAULT_BESTILLINGER_LINE_WIDTH = 1.1
 DEFAULT_LINE_WIDTH = 0.6
 DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH = 0.5
@@ -31,6 +35,9 @@ DEFAULT_STIKKLEDNING_WIDTH = 0.3
 STATUS_ERSTATTET_NEDLAGT = "\"status\" = 'E' OR \"status\" = 'EF' OR \"status\" = 'F' OR \"status\" = 'EN'"
 STATUS_PROSJEKTERT_IKKE_I_BRUK = "\"status\" = 'P' OR \"status\" = 'I'"
 
+# increase when styles built by MapRefresher change without a change in LAYERS
+STYLE_VERSION = 1
+
 LAYERS = [
             {
                 "group": "RioGIS",
@@ -74,11 +81,9 @@ LAYERS = [
                                 "width": DEFAULT_BESTILLINGER_LINE_WIDTH,
                             },
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Bestillinger",
-                            "Bestillinger",
-                            "ogr",
-                        ),
+                        "source": "source",
+                        "layername": "Bestillinger",
+                        "name": "Bestillinger",
                         "label": "fcode || lsid || '  '",
                     },
                     
@@ -109,9 +114,9 @@ LAYERS = [
                                 "fill": "transparent",
                             },
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Prosjekt", "Prosjekt", "ogr"
-                        ),
+                        "source": "source",
+                        "layername": "Prosjekt",
+                        "name": "Prosjekt",
                         "label": "project_name || ': \n' ||comments",
                     },
                     
@@ -121,72 +126,6 @@ LAYERS = [
                 "group": "VA-data",
                 "disable_group": True,
                 "items": [
-                    {
-                        "rules": [
-                            {
-                                "expression": f"\"fcode\" = 'AF' AND {STATUS_ERSTATTET_NEDLAGT}",
-                                "color": QColor(234, 10, 0, alpha=200),
-                                "legend_label": "Avløp (Erstattet/Nedlagt)",
-                                "width": DEFAULT_LINE_WIDTH,
-                            },
-                            {
-                                "expression": f"\"fcode\" = 'SP' AND {STATUS_ERSTATTET_NEDLAGT}",
-                                "color": QColor(0, 200, 0, alpha=200),
-                                "legend_label": "Spillvann (Erstattet/Nedlagt)",
-                                "width": DEFAULT_LINE_WIDTH,
-                            },
-                            {
-                                "expression": f"\"fcode\" = 'OV' AND {STATUS_ERSTATTET_NEDLAGT}",
-                                "color": QColor(0, 0, 0, alpha=200),
-                                "legend_label": "Overvann (Erstattet/Nedlagt)",
-                                "width": DEFAULT_LINE_WIDTH,
-                            },
-                            {
-                                "expression": f"\"fcode\" = 'AF' AND {STATUS_PROSJEKTERT_IKKE_I_BRUK}",
-                                "color": QColor(234, 10, 0, alpha=200),
-                                "legend_label": "Avløp (Prosjektert/Ikke i bruk)",
-                                "width": DEFAULT_LINE_WIDTH,
-                            },
-                            {
-                                "expression": f"\"fcode\" = 'SP' AND {STATUS_PROSJEKTERT_IKKE_I_BRUK}",
-                                "color": QColor(0, 200, 0, alpha=200),
-                                "legend_label": "Spillvann (Prosjektert/Ikke i bruk)",
-                                "width": DEFAULT_LINE_WIDTH,
-                            },
-                            {
-                                "expression": f"\"fcode\" = 'OV' AND {STATUS_PROSJEKTERT_IKKE_I_BRUK}",
-                                "color": QColor(0, 0, 0, alpha=200),
-                                "legend_label": "Overvann (Prosjektert/Ikke i bruk)",
-                                "width": DEFAULT_LINE_WIDTH,
-                            }
-                        ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Avløpsledning", "Avløpsledning (Ikke drift)", "ogr"
-                        ),
-                        "collapsed": True,
-                        "disable_at_startup": True,
-                    },
-                    {
-                        "rules": [
-                            {
-                                "expression": f"\"fcode\" = 'AF' AND {STATUS_ERSTATTET_NEDLAGT}",
-                                "color": QColor(0, 0, 200, alpha=200),
-                                "legend_label": "Vann (Erstattet/Nedlagt)",
-                                "width": DEFAULT_LINE_WIDTH,
-                            },
-                            {
-                                "expression": f"\"fcode\" = 'AF' AND {STATUS_PROSJEKTERT_IKKE_I_BRUK}",
-                                "color": QColor(0, 0, 200, alpha=200),
-                                "legend_label": "Vann (Prosjektert/Ikke i bruk)",
-                                "width": DEFAULT_LINE_WIDTH,
-                            }
-                        ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Vannledning", "Vannledning (Ikke drift)", "ogr"
-                        ),
-                        "collapsed": True,
-                        "disable_at_startup": True,
-                    },
                     {
                         "rules": [
                             {
@@ -214,123 +153,195 @@ LAYERS = [
                                 "width": DEFAULT_STIKKLEDNING_WIDTH,
                             }
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Stikkledninger", "Stikkledninger", "ogr"
-                        ),
+                        "source": "source",
+                        "layername": "Stikkledninger",
+                        "name": "Stikkledninger",
                         "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
+                        "line_style": "dash",
                         "collapsed": True,
                     },
                     {
-                        "rules": [
+                        "rule_groups": [
                             {
-                                "expression": "\"owner\" != 'K'",
-                                "color": QColor(80, 200, 80, alpha=200),
-                                "legend_label": "Kum",
-                                "size": 1.5,
-                            }
-                        ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Kum", "Kum (ikke kommunalt)", "ogr"
-                        ),
-                        "label": "psid",
-                        "collapsed": True,
-                    },
-                    {
-                        "rules": [
+                                "legend_label": "Ikke kommunalt",
+                                "rules": [
+                                    {
+                                        "expression": "\"owner\" != 'K'",
+                                        "color": QColor(80, 200, 80, alpha=200),
+                                        "legend_label": "Kum",
+                                        "size": 1.5,
+                                    }
+                                ],
+                                "label": "psid",
+                                "label_style": "Kum (ikke kommunalt)",
+                            },
                             {
-                                "expression": "\"fcode\" = 'VL' AND \"owner\" != 'K'",
-                                "color": QColor(0, 0, 200, alpha=200),
-                                
-                                "legend_label": "Vann",
-                                "width": DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH,
-                            }
+                                "legend_label": "Kommunalt",
+                                "rules": [
+                                    {
+                                        "expression": "\"owner\" = 'K'",
+                                        "color": QColor(122, 122, 122, alpha=200),
+                                        "legend_label": "Kum",
+                                        "size": 1.5,
+                                    }
+                                ],
+                                "label": "psid",
+                            },
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Vannledning", "Vannledning (ikke kommunalt)", "ogr"
-                        ),
-                        "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
-                        "collapsed": True,
+                        "source": "source",
+                        "layername": "Kum",
+                        "name": "Kum",
                     },
                     {
-                        "rules": [
+                        "rule_groups": [
                             {
-                                "expression": "\"fcode\" = 'AF' AND \"owner\" != 'K'",
-                                "color": QColor(234, 10, 0, alpha=200),
-                                "legend_label": "Avløp",
-                                "width": DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH,
+                                "legend_label": "Ikke drift",
+                                "rules": [
+                                    {
+                                        "expression": f"\"fcode\" = 'AF' AND {STATUS_ERSTATTET_NEDLAGT}",
+                                        "color": QColor(0, 0, 200, alpha=200),
+                                        "legend_label": "Vann (Erstattet/Nedlagt)",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": f"\"fcode\" = 'AF' AND {STATUS_PROSJEKTERT_IKKE_I_BRUK}",
+                                        "color": QColor(0, 0, 200, alpha=200),
+                                        "legend_label": "Vann (Prosjektert/Ikke i bruk)",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    }
+                                ],
+                                "line_style": "dot",
+                                "disable_at_startup": True,
                             },
                             {
-                                "expression": "\"fcode\" = 'SP' AND \"owner\" != 'K'",
-                                "color": QColor(0, 200, 0, alpha=200),
-                                "legend_label": "Spillvann",
-                                "width": DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH,
+                                "legend_label": "Ikke kommunalt",
+                                "rules": [
+                                    {
+                                        "expression": "\"fcode\" = 'VL' AND \"owner\" != 'K'",
+                                        "color": QColor(0, 0, 200, alpha=200),
+                                        "legend_label": "Vann",
+                                        "width": DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH,
+                                    }
+                                ],
+                                "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
+                                "line_style": "dash",
                             },
                             {
-                                "expression": "\"fcode\" = 'OV' AND \"owner\" != 'K'",
-                                "color": QColor(0, 0, 0, alpha=200),
-                                "legend_label": "Overvann",
-                                "width": DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH,
-                            }
-                        ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Avløpsledning", "Avløpsledning (ikke kommunalt)", "ogr"
-                        ),
-                        "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
-                        "collapsed": True,
-                    },
-                    {
-                        "rules": [
-                            {
-                                "expression": "\"owner\" = 'K'",
-                                "color": QColor(122, 122, 122, alpha=200),
-                                "legend_label": "Kum",
-                                "size": 1.5,
-                            }
-                        ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Kum", "Kum", "ogr"
-                        ),
-                        "label": "psid",
-                    },
-                    {
-                        "rules": [
-                            {
-                                "expression": "\"fcode\" = 'VL' AND \"owner\" = 'K'",
-                                "color": QColor(0, 0, 200, alpha=200),
-                                "legend_label": "Vann",
-                                "width": DEFAULT_LINE_WIDTH,
-                            }
+                                "legend_label": "Kommunalt",
+                                "rules": [
+                                    {
+                                        "expression": "\"fcode\" = 'VL' AND \"owner\" = 'K'",
+                                        "color": QColor(0, 0, 200, alpha=200),
+                                        "legend_label": "Vann",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    }
+                                ],
+                                "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
+                            },
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Vannledning", "Vannledning", "ogr"
-                        ),
-                        "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
+                        "source": "source",
+                        "layername": "Vannledning",
+                        "name": "Vannledning",
                     },
                     {
-                        "rules": [
+                        "rule_groups": [
                             {
-                                "expression": "\"fcode\" = 'AF' AND \"owner\" = 'K' AND \"status\" = 'D'",
-                                "color": QColor(234, 10, 0, alpha=200),
-                                "legend_label": "Avløp",
-                                "width": DEFAULT_LINE_WIDTH,
+                                "legend_label": "Ikke drift",
+                                "rules": [
+                                    {
+                                        "expression": f"\"fcode\" = 'AF' AND {STATUS_ERSTATTET_NEDLAGT}",
+                                        "color": QColor(234, 10, 0, alpha=200),
+                                        "legend_label": "Avløp (Erstattet/Nedlagt)",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": f"\"fcode\" = 'SP' AND {STATUS_ERSTATTET_NEDLAGT}",
+                                        "color": QColor(0, 200, 0, alpha=200),
+                                        "legend_label": "Spillvann (Erstattet/Nedlagt)",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": f"\"fcode\" = 'OV' AND {STATUS_ERSTATTET_NEDLAGT}",
+                                        "color": QColor(0, 0, 0, alpha=200),
+                                        "legend_label": "Overvann (Erstattet/Nedlagt)",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": f"\"fcode\" = 'AF' AND {STATUS_PROSJEKTERT_IKKE_I_BRUK}",
+                                        "color": QColor(234, 10, 0, alpha=200),
+                                        "legend_label": "Avløp (Prosjektert/Ikke i bruk)",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": f"\"fcode\" = 'SP' AND {STATUS_PROSJEKTERT_IKKE_I_BRUK}",
+                                        "color": QColor(0, 200, 0, alpha=200),
+                                        "legend_label": "Spillvann (Prosjektert/Ikke i bruk)",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": f"\"fcode\" = 'OV' AND {STATUS_PROSJEKTERT_IKKE_I_BRUK}",
+                                        "color": QColor(0, 0, 0, alpha=200),
+                                        "legend_label": "Overvann (Prosjektert/Ikke i bruk)",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    }
+                                ],
+                                "line_style": "dot",
+                                "disable_at_startup": True,
                             },
                             {
-                                "expression": "\"fcode\" = 'SP' AND \"owner\" = 'K' AND \"status\" = 'D'",
-                                "color": QColor(0, 200, 0, alpha=200),
-                                "legend_label": "Spillvann",
-                                "width": DEFAULT_LINE_WIDTH,
+                                "legend_label": "Ikke kommunalt",
+                                "rules": [
+                                    {
+                                        "expression": "\"fcode\" = 'AF' AND \"owner\" != 'K'",
+                                        "color": QColor(234, 10, 0, alpha=200),
+                                        "legend_label": "Avløp",
+                                        "width": DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": "\"fcode\" = 'SP' AND \"owner\" != 'K'",
+                                        "color": QColor(0, 200, 0, alpha=200),
+                                        "legend_label": "Spillvann",
+                                        "width": DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": "\"fcode\" = 'OV' AND \"owner\" != 'K'",
+                                        "color": QColor(0, 0, 0, alpha=200),
+                                        "legend_label": "Overvann",
+                                        "width": DEFAULT_IKKE_KOMMUNAL_LINE_WIDTH,
+                                    }
+                                ],
+                                "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
+                                "line_style": "dash",
                             },
                             {
-                                "expression": "\"fcode\" = 'OV' AND \"owner\" = 'K' AND \"status\" = 'D'",
-                                "color": QColor(0, 0, 0, alpha=200),
-                                "legend_label": "Overvann",
-                                "width": DEFAULT_LINE_WIDTH,
-                            }
+                                "legend_label": "Kommunalt",
+                                "rules": [
+                                    {
+                                        "expression": "\"fcode\" = 'AF' AND \"owner\" = 'K' AND \"status\" = 'D'",
+                                        "color": QColor(234, 10, 0, alpha=200),
+                                        "legend_label": "Avløp",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": "\"fcode\" = 'SP' AND \"owner\" = 'K' AND \"status\" = 'D'",
+                                        "color": QColor(0, 200, 0, alpha=200),
+                                        "legend_label": "Spillvann",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    },
+                                    {
+                                        "expression": "\"fcode\" = 'OV' AND \"owner\" = 'K' AND \"status\" = 'D'",
+                                        "color": QColor(0, 0, 0, alpha=200),
+                                        "legend_label": "Overvann",
+                                        "width": DEFAULT_LINE_WIDTH,
+                                    }
+                                ],
+                                "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
+                                "line_style": "arrows",
+                            },
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{source_filepath}|layername=Avløpsledning", "Avløpsledning", "ogr"
-                        ),
-                        "label": "dim || ' ' || material || ' ' || fcode || lsid || '  '",
+                        "source": "source",
+                        "layername": "Avløpsledning",
+                        "name": "Avløpsledning",
                     },
                 ],
             },
@@ -348,9 +359,9 @@ LAYERS = [
                                 "fill": QColor(72, 196, 255, alpha=65),
                             }
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{bg_filepath}|layername=T32_0301vann_flate", "Vann", "ogr"
-                        ),
+                        "source": "background",
+                        "layername": "T32_0301vann_flate",
+                        "name": "Vann",
                     },
                     {
                         "rules": [
@@ -363,9 +374,9 @@ LAYERS = [
                                 "fill": QColor(230, 230, 230, alpha=255),
                             }
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{bg_filepath}|layername=T32_0301veg_flate", "Veg", "ogr"
-                        ),
+                        "source": "background",
+                        "layername": "T32_0301veg_flate",
+                        "name": "Veg",
                     },              
                     {
                         "rules": [
@@ -379,11 +390,9 @@ LAYERS = [
                                 "minimumScale": 8000
                             }
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{bg_filepath}|layername=T32_0301bygning_flate",
-                            "Bygning",
-                            "ogr",
-                        ),
+                        "source": "background",
+                        "layername": "T32_0301bygning_flate",
+                        "name": "Bygning",
                     },
                     {
                         "rules": [
@@ -393,11 +402,9 @@ LAYERS = [
                                 "legend_label": "",
                             }
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{bg_filepath}|layername=T32_0301_eiendomskart_linje",
-                            "Eiendomskart",
-                            "ogr",
-                        ),
+                        "source": "background",
+                        "layername": "T32_0301_eiendomskart_linje",
+                        "name": "Eiendomskart",
                         "disable_at_startup": True,
                     },
                     {
@@ -408,11 +415,9 @@ LAYERS = [
                                 "legend_label": "",
                             }
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{bg_filepath}|layername=T32_0301hoydekurve_5m_linje",
-                            "Høydekurve",
-                            "ogr",
-                        ),
+                        "source": "background",
+                        "layername": "T32_0301hoydekurve_5m_linje",
+                        "name": "Høydekurve",
                     },
                     {
                         "rules": [
@@ -432,11 +437,9 @@ LAYERS = [
                                 "legend_label": "Hydrant",
                             },
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{bg_filepath}|layername=T32_0301ledning_punkt",
-                            "VApunkt",
-                            "ogr",
-                        ),
+                        "source": "background",
+                        "layername": "T32_0301ledning_punkt",
+                        "name": "VApunkt",
                         "disable_at_startup": True,
                         "collapsed": True,
                     },
@@ -479,23 +482,106 @@ LAYERS = [
                                 "minimumScale": 1000
                             },
                         ],
-                        "geometry": QgsVectorLayer(
-                            f"{bg_filepath}|layername=T32_0301_tekst1000_punkt",
-                            "Tekst",
-                            "ogr",
-                        ),
+                        "source": "background",
+                        "layername": "T32_0301_tekst1000_punkt",
+                        "name": "Tekst",
                         "label": "STRENG",
                     },
                 ],
             },
         ]
 
+def _spec_json_default(value):
+    if isinstance(value, QColor):
+        return value.name(QColor.HexArgb)
+
+    raise TypeError(f"Can not serialize {type(value)} in layer spec")
+
+def layers_spec_hash():
+    """
+    Get hash of layer specs, changes when a layer, rule or label in LAYERS is changed
+
+    Returns:
+        str: hash
+    """
+    spec = json.dumps(LAYERS, sort_keys=True, default=_spec_json_default)
+    return hashlib.md5(spec.encode("utf-8")).hexdigest()
+
+def style_version_hash():
+    """
+    Get hash of everything styles are built from: LAYERS, STYLE_VERSION and the
+    plugin version, since code building styles can change in a plugin upgrade
+
+    Returns:
+        str: hash
+    """
+    version = f"{layers_spec_hash()}:{STYLE_VERSION}:{utils.get_plugin_version()}"
+    return hashlib.md5(version.encode("utf-8")).hexdigest()
+
 class MissingSourceError(Exception):
     pass
 
 class MapRefresher:
+    """
+    Builds the map from the layer specs in LAYERS
+
+    Layers are constructed when the map is refreshed, from the source files in
+    the SOURCE_MAP and BACKGROUND_MAP environment variables. Layers marked
+    disable_at_startup are added as empty placeholder groups, and are only
+    constructed when the user checks the placeholder. Styles of layers are
+    built once and cached as .qml files.
+
+    Attributes:
+    layers : dict
+        name -> QgsVectorLayer of constructed layers
+    """
+
+    LAZY_LAYER_PROPERTY = "riogis/lazy_layer"
+    LAZY_SOURCE_PROPERTY = "riogis/lazy_source"
+
+    def __init__(self):
+        self.layers = {}
+        self._style_dir = None
+        self._is_connected = False
+
+    def connect_lazy_layers(self):
+        """
+        Construct layers hidden at startup when their placeholders are checked. The layer
+        tree root is kept when a project is read, so this also covers projects opened
+        directly in QGIS.
+        """
+        if self._is_connected:
+            return
 
-    def refresh_map(self, filename):
+        QgsProject.instance().layerTreeRoot().visibilityChanged.connect(self._handle_visibility_changed)
+        self._is_connected = True
+
+    def disconnect_lazy_layers(self):
+        """
+        Stop constructing layers when placeholders are checked, e.g. when the plugin is unloaded
+        """
+        if not self._is_connected:
+            return
+
+        QgsProject.instance().layerTreeRoot().visibilityChanged.disconnect(self._handle_visibility_changed)
+        self._is_connected = False
+
+    def refresh_map(self, filename, rebuild=False):
+        """
+        Load map from project file, or build it from LAYERS if the layer specs or
+        the schema of the source files changed since the project file was written
+
+        Args:
+            filename (str): path to project file (.qgz)
+            rebuild (bool, optional): build map even if project file is up to date. Defaults to False.
+
+        Returns:
+            QgsProject: project
+        """
+
+        source_filepaths = self._source_filepaths()
+        source_filepath = source_filepaths["source"]
+        bg_filepath = source_filepaths["background"]
 
         assert 'db' in source_filepath
         assert 'gpkg' in bg_filepath
@@ -505,11 +591,19 @@ class MapRefresher:
             raise MissingSourceError(f'Missing source: {source_filepath}')
         elif not os.path.exists(bg_filepath):
             raise MissingSourceError(f'Missing source: {bg_filepath}')
+
+        fingerprint = self._fingerprint(source_filepaths)
+
+        if not rebuild and self._load_project(filename, fingerprint):
+            utils.printInfoMessage("Lastet kart")
+            return QgsProject.instance()
         
         project = QgsProject.instance()
         project.clear()
         project.setFileName(filename)
         root = project.layerTreeRoot()
+
+        self.layers = {}
         
         for groups in LAYERS:
             name = groups["group"]
@@ -517,15 +611,19 @@ class MapRefresher:
             group = root.addGroup(name)
 
             for maps in reversed(items):
-                self.add_map_layers(group, maps, name)
+                if maps.get("disable_at_startup"):
+                    self._add_lazy_layer_placeholder(group, maps, name, source_filepaths[maps["source"]])
+                else:
+                    self.add_map_layers(group, maps, name, source_filepaths[maps["source"]])
 
             disable_group = groups.get("disable_group")
 
             if disable_group:
                 group.setItemVisibilityChecked(not disable_group)
 
-        # Save the project as a .qgz file
+        # Save the project as a .qgz file, it is loaded instead of built next time
         project.write()
+        self._write_fingerprint(filename, fingerprint)
 
         utils.printInfoMessage("Lastet kart")
 
@@ -536,43 +634,404 @@ class MapRefresher:
         """
         
         # layer to zoom to
-        layer = LAYERS[0]["items"][0]["geometry"]
+        layer = self.layers[LAYERS[0]["items"][0]["name"]]
         canvas = iface.mapCanvas()
         canvas.setExtent(layer.extent())
         canvas.refresh()
+
+    def create_layer(self, maps, filepath):
+        """
+        Construct layer from layer spec
+
+        Args:
+            maps (dict): layer spec from LAYERS
+            filepath (str): path to source file of layer
+
+        Returns:
+            QgsVectorLayer: layer
+        """
+        return QgsVectorLayer(f"{filepath}|layername={maps['layername']}", maps["name"], "ogr")
     
-    def add_map_layers(self, group, maps, name):
-        layer = maps["geometry"]
-        label = maps.get("label")
-        
-        if label:
-            self._set_map_label(layer, label)
+    def add_map_layers(self, group, maps, name, filepath, index=None):
+        layer = self.create_layer(maps, filepath)
         
         layer.setCrs(QgsCoordinateReferenceSystem("EPSG:25832"))
-        
-        if maps["rules"]:
-            self._add_rules(layer, maps, name, label)
-        elif maps.get("raster"):
-            pass
 
-        group.addLayer(layer)
+        style_filename = self._style_filename(maps)
+        _, is_style_loaded = layer.loadNamedStyle(style_filename) if os.path.exists(style_filename) else (None, False)
+
+        if not is_style_loaded:
+            self._set_style(layer, maps, name)
+            layer.saveNamedStyle(style_filename)
+
+        self._connect_label_sync(layer)
+
+        QgsProject.instance().addMapLayer(layer, False)
+
+        if index is None:
+            group.addLayer(layer)
+        else:
+            group.insertLayer(index, layer)
+
+        self.layers[maps["name"]] = layer
         
         collapsed = maps.get("collapsed")
-        disable_at_startup = maps.get("disable_at_startup")
 
         if collapsed:
             root = QgsProject.instance().layerTreeRoot()
             myLayerNode = root.findLayer(layer.id())
             myLayerNode.setExpanded(not collapsed)
+
+        return layer
+
+    def _set_style(self, layer, maps, name):
+        label = maps.get("label")
+        
+        if label:
+            self._set_map_label(layer, label)
         
-        # dont show items marked disable_at_startup
-        if disable_at_startup:
-            group.findLayer(layer).setItemVisibilityChecked(not disable_at_startup)
+        if maps.get("rule_groups"):
+            self._add_rule_groups(layer, maps)
+        elif maps["rules"]:
+            self._add_rules(layer, maps, name, label)
+        elif maps.get("raster"):
+            pass
+
+    def _style_filename(self, maps):
+        """
+        Get path to cached style (.qml) of layer. Styles are built from LAYERS once,
+        and cached in a folder named by the hash of LAYERS and the style and plugin versions
+
+        Args:
+            maps (dict): layer spec from LAYERS
+
+        Returns:
+            str: path to style file
+        """
+        if self._style_dir is None:
+            style_cache_dir = utils.get_style_cache_dir()
+            self._style_dir = os.path.join(style_cache_dir, style_version_hash())
+
+            # styles built from earlier versions of LAYERS are not used again
+            if os.path.isdir(style_cache_dir):
+                for dirname in os.listdir(style_cache_dir):
+                    if os.path.join(style_cache_dir, dirname) != self._style_dir:
+                        shutil.rmtree(os.path.join(style_cache_dir, dirname), ignore_errors=True)
+
+            os.makedirs(self._style_dir, exist_ok=True)
+
+        return os.path.join(self._style_dir, f"{maps['name']}.qml")
+
+    def _source_filepaths(self):
+        """
+        Get paths to source files, set by RioGIS before the map is refreshed
+
+        Returns:
+            dict: "source"/"background" -> path
+        """
+        return {
+            "source": os.getenv('SOURCE_MAP'),
+            "background": os.getenv('BACKGROUND_MAP'),
+        }
+
+    def _fingerprint(self, source_filepaths):
+        """
+        Get fingerprint of layer specs, style and plugin versions, and of the schema of the tables the layers read
+
+        Args:
+            source_filepaths (dict): "source"/"background" -> path
+
+        Returns:
+            str: fingerprint
+        """
+        layernames = {}
+
+        for groups in LAYERS:
+            for maps in groups["items"]:
+                layernames.setdefault(maps["source"], set()).add(maps["layername"])
+
+        sources = {
+            source: {
+                "path": source_filepaths[source],
+                "schema": self._source_schema(source_filepaths[source], layernames[source]),
+            }
+            for source in sorted(layernames)
+        }
+
+        fingerprint = {
+            # plugin upgrades can change how layers are built, also when LAYERS is unchanged
+            "layers": style_version_hash(),
+            "sources": sources,
+        }
+
+        return hashlib.md5(json.dumps(fingerprint, sort_keys=True).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _source_schema(filepath, layernames):
+        """
+        Get columns of tables in GeoPackage
+
+        Args:
+            filepath (str): path to GeoPackage
+            layernames (set): names of tables
+
+        Returns:
+            dict: table name -> list of (name, type) of columns
+        """
+        with closing(sqlite3.connect(filepath)) as connection:
+            return {
+                layername: [
+                    (column[1], column[2])
+                    for column in connection.execute(f'PRAGMA table_info("{layername}")')
+                ]
+                for layername in sorted(layernames)
+            }
+
+    @staticmethod
+    def _fingerprint_filename(filename):
+        root, _ = os.path.splitext(filename)
+        return root + "_fingerprint.json"
+
+    def _write_fingerprint(self, filename, fingerprint):
+        with open(self._fingerprint_filename(filename), "w") as f:
+            json.dump({"fingerprint": fingerprint}, f)
+
+    def _load_project(self, filename, fingerprint):
+        """
+        Load project file if it was written with the same fingerprint
+
+        Args:
+            filename (str): path to project file (.qgz)
+            fingerprint (str): fingerprint of layer specs and source files
+
+        Returns:
+            bool: True if project is loaded
+        """
+        fingerprint_filename = self._fingerprint_filename(filename)
+
+        if not os.path.exists(filename) or not os.path.exists(fingerprint_filename):
+            return False
+
+        try:
+            with open(fingerprint_filename, "r") as f:
+                if json.load(f).get("fingerprint") != fingerprint:
+                    return False
+        except (OSError, ValueError):
+            return False
+
+        project = QgsProject.instance()
+
+        if not project.read(filename):
+            return False
+
+        self.layers = {layer.name(): layer for layer in project.mapLayers().values()}
+
+        for layer in self.layers.values():
+            self._connect_label_sync(layer)
+
+        # placeholders of layers hidden at startup are kept in project file, and constructed when checked
+        expected_names = [
+            maps["name"]
+            for groups in LAYERS
+            for maps in groups["items"] if not maps.get("disable_at_startup")
+        ]
+
+        return all(name in self.layers and self.layers[name].isValid() for name in expected_names)
+
+    def _add_lazy_layer_placeholder(self, group, maps, name, filepath):
+        """
+        Add unchecked, empty group in place of a layer that is hidden at startup
+
+        Args:
+            group (QgsLayerTreeGroup): group to add placeholder to
+            maps (dict): layer spec from LAYERS
+            name (str): name of group in LAYERS
+            filepath (str): path to source file of layer
+        """
+        placeholder = group.addGroup(maps["name"])
+        placeholder.setCustomProperty(self.LAZY_LAYER_PROPERTY, f"{name}/{maps['name']}")
+        placeholder.setCustomProperty(self.LAZY_SOURCE_PROPERTY, filepath)
+        placeholder.setItemVisibilityChecked(False)
+
+    def _handle_visibility_changed(self, node):
+        if not node.customProperty(self.LAZY_LAYER_PROPERTY) or not node.itemVisibilityChecked():
+            return
+
+        # the placeholder is replaced, so wait until the signal is handled. The node may be
+        # deleted by then, so the placeholder is looked up again by its key
+        key = node.customProperty(self.LAZY_LAYER_PROPERTY)
+        QTimer.singleShot(0, lambda: self._construct_lazy_layer(key))
+
+    def _find_lazy_placeholder(self, key):
+        """
+        Find placeholder of a layer hidden at startup in the layer tree
+
+        Args:
+            key (str): "group/name" of the layer in LAYERS
+
+        Returns:
+            QgsLayerTreeGroup: placeholder group, or None if the layer tree has no such placeholder
+        """
+        groups = QgsProject.instance().layerTreeRoot().findGroups()
+
+        while groups:
+            group = groups.pop()
+
+            if group.customProperty(self.LAZY_LAYER_PROPERTY) == key:
+                return group
+
+            groups.extend(group.findGroups())
+
+        return None
+
+    def _construct_lazy_layer(self, key):
+        """
+        Replace placeholder with the layer it stands in for
+
+        Args:
+            key (str): "group/name" of the layer in LAYERS
+        """
+        placeholder = self._find_lazy_placeholder(key)
+
+        if placeholder is None or not placeholder.itemVisibilityChecked():
+            return
+
+        group = placeholder.parent()
+
+        if group is None:
+            return
+
+        group_name, layer_name = key.split("/", 1)
+        filepath = placeholder.customProperty(self.LAZY_SOURCE_PROPERTY)
+
+        maps = next(
+            (
+                maps
+                for groups in LAYERS if groups["group"] == group_name
+                for maps in groups["items"] if maps["name"] == layer_name
+            ),
+            None,
+        )
+
+        if maps is None:
+            return
+
+        index = group.children().index(placeholder)
+        group.removeChildNode(placeholder)
+
+        self.add_map_layers(group, maps, group_name, filepath, index)
+
+        QgsProject.instance().write()
 
     def _add_rules(self, layer, maps, name, label):
-    
+        line_style = maps.get("line_style")
+        symbol = self._base_symbol(layer, line_style)
+
+        renderer = QgsRuleBasedRenderer(QgsRuleBasedRenderer.Rule(None))
+
+        for rulebook in maps["rules"]:
+            renderer.rootRule().appendChild(self._create_rule(rulebook, symbol, line_style))
         
-        if layer.name() == "Avløpsledning":
+        layer.setRenderer(renderer)
+        layer.triggerRepaint()
+
+    def _add_rule_groups(self, layer, maps):
+        """
+        Add nested rules for the variants of a layer, e.g. municipal and non-municipal pipes.
+        Each rule group gets its own line style and labels. Rule groups disabled at startup
+        are inactive, and can be checked in the legend of the layer. The labels of a rule
+        group are shown when the rule group is checked, see _sync_labels_with_legend.
+
+        Args:
+            layer (QgsVectorLayer): layer
+            maps (dict): layer spec from LAYERS
+        """
+        renderer = QgsRuleBasedRenderer(QgsRuleBasedRenderer.Rule(None))
+        root_label_rule = QgsRuleBasedLabeling.Rule(None)
+
+        for rule_group in maps["rule_groups"]:
+            line_style = rule_group.get("line_style")
+            symbol = self._base_symbol(layer, line_style)
+            is_active = not rule_group.get("disable_at_startup")
+
+            group_rule = QgsRuleBasedRenderer.Rule(None, label=rule_group["legend_label"])
+            group_rule.setActive(is_active)
+
+            for rulebook in rule_group["rules"]:
+                group_rule.appendChild(self._create_rule(rulebook, symbol, line_style))
+
+            renderer.rootRule().appendChild(group_rule)
+
+            label = rule_group.get("label")
+
+            if not label:
+                continue
+
+            label_rule = QgsRuleBasedLabeling.Rule(self._label_settings(layer, label, rule_group.get("label_style")))
+            label_rule.setDescription(rule_group["legend_label"])
+            label_rule.setFilterExpression(" OR ".join(f"({rulebook['expression']})" for rulebook in rule_group["rules"]))
+            label_rule.setActive(is_active)
+            root_label_rule.appendChild(label_rule)
+
+        layer.setRenderer(renderer)
+
+        if root_label_rule.children():
+            layer.setLabelsEnabled(True)
+            layer.setLabeling(QgsRuleBasedLabeling(root_label_rule))
+
+        layer.triggerRepaint()
+
+    def _connect_label_sync(self, layer):
+        """
+        Let the labels of the rule groups of a layer follow the check state of
+        the rule groups in the legend
+
+        Args:
+            layer (QgsMapLayer): layer
+        """
+        if not isinstance(layer, QgsVectorLayer) or not isinstance(layer.labeling(), QgsRuleBasedLabeling):
+            return
+
+        # checking a rule in the legend toggles the renderer rule and emits styleChanged
+        layer.styleChanged.connect(lambda: self._sync_labels_with_legend(layer))
+        self._sync_labels_with_legend(layer)
+
+    @staticmethod
+    def _sync_labels_with_legend(layer):
+        """
+        Activate the label rule of each rule group of a layer if the rule group is
+        checked in the legend. Label rules are matched with rule groups by description.
+
+        Args:
+            layer (QgsVectorLayer): layer
+        """
+        renderer = layer.renderer()
+        labeling = layer.labeling()
+
+        if not isinstance(renderer, QgsRuleBasedRenderer) or not isinstance(labeling, QgsRuleBasedLabeling):
+            return
+
+        is_group_active = {rule.label(): rule.active() for rule in renderer.rootRule().children()}
+
+        for label_rule in labeling.rootRule().children():
+            is_active = is_group_active.get(label_rule.description())
+
+            if is_active is not None:
+                label_rule.setActive(is_active)
+
+    def _base_symbol(self, layer, line_style=None):
+        """
+        Get symbol that the symbols of the rules are based on
+
+        Args:
+            layer (QgsVectorLayer): layer
+            line_style (str, optional): "arrows" for lines with flow direction, or "dash"/"dot". Defaults to None.
+
+        Returns:
+            QgsSymbol: symbol
+        """
+    
+        if line_style == "arrows":
             symbol = QgsSymbol.defaultSymbol(layer.geometryType())
             
             marker_line_layer = QgsMarkerLineSymbolLayer.create({'interval': '25', 'interval_unit': 'MM', 'place_on_every_part': True, 'placements': 'Interval', 'ring_filter': '0', 'rotate': '1'})
@@ -595,62 +1054,72 @@ class MapRefresher:
             symbol.appendSymbolLayer(lineLayer)  
             symbol.appendSymbolLayer(marker_line_layer)  
             
-        elif ("ikke kommunalt" in layer.name() or layer.name() == "Stikkledninger") and layer.geometryType() == Qgis.GeometryType.Line:
-            symbol = QgsLineSymbol.createSimple({'line_style':'dash'})
-        elif "Ikke drift" in layer.name() and layer.geometryType() == Qgis.GeometryType.Line:
-            symbol = QgsLineSymbol.createSimple({'line_style':'dot'})
+        elif line_style in ["dash", "dot"] and layer.geometryType() == Qgis.GeometryType.Line:
+            symbol = QgsLineSymbol.createSimple({'line_style': line_style})
         else:
             symbol = QgsSymbol.defaultSymbol(layer.geometryType())
-        renderer = QgsRuleBasedRenderer(symbol)
-        root_rule = None
-        
-        for i, rulebook in enumerate(maps["rules"]):
-            if root_rule is None:
-                
-                # TODO fails when first time after syncing
-                root_rule = renderer.rootRule()
-                try:
-                    rule = root_rule.children()[0]
-                except Exception as e: 
-                    utils.printCriticalMessage(f"Lasting av kartlag {name} - {layer.name()} feilet! Start QGIS på nytt og prøv igjen! \n{str(e)}", message_duration=0)
-                    return
-            else:
-                rule = root_rule.children()[0].clone()
 
-            rule.setLabel(rulebook["legend_label"])
-            rule.setFilterExpression(rulebook["expression"])
-            
-            rule_symbol = rule.symbol()
-            
-            if "size" in rulebook:
-                rule_symbol.setSize(rulebook["size"])
-                rule_symbol.setSizeUnit(Qgis.RenderUnit.MetersInMapUnits)
-                
-            line_layer_index = 0
-            
-            if "minimumScale" in rulebook:
-                rule.setMinimumScale(rulebook["minimumScale"])
+        return symbol
+
+    def _create_rule(self, rulebook, symbol, line_style=None):
+        """
+        Create renderer rule from rule spec
+
+        Args:
+            rulebook (dict): rule spec from LAYERS
+            symbol (QgsSymbol): base symbol, is cloned
+            line_style (str, optional): line style of base symbol. Defaults to None.
+
+        Returns:
+            QgsRuleBasedRenderer.Rule: rule
+        """
+        rule = QgsRuleBasedRenderer.Rule(symbol.clone(), filterExp=rulebook["expression"], label=rulebook["legend_label"])
+        
+        rule_symbol = rule.symbol()
+        
+        if "size" in rulebook:
+            rule_symbol.setSize(rulebook["size"])
+            rule_symbol.setSizeUnit(Qgis.RenderUnit.MetersInMapUnits)
             
-            if "outline" in rulebook:
-                rule_symbol.setColor(QColor(rulebook["fill"]))
-                rule_symbol.symbolLayer(line_layer_index).setStrokeColor(rulebook["color"])
-                rule_symbol.symbolLayer(line_layer_index).setStrokeWidth(rulebook["width"])
-            elif "width" in rulebook:
-                rule_symbol.symbolLayer(line_layer_index).setWidth(rulebook["width"])
-                if layer.name() == "Avløpsledning":
-                    rule_symbol.symbolLayer(line_layer_index).setColor(rulebook["color"])
-                else:
-                    rule_symbol.setColor(rulebook["color"])
+        line_layer_index = 0
+        
+        if "minimumScale" in rulebook:
+            rule.setMinimumScale(rulebook["minimumScale"])
+        
+        if "outline" in rulebook:
+            rule_symbol.setColor(QColor(rulebook["fill"]))
+            rule_symbol.symbolLayer(line_layer_index).setStrokeColor(rulebook["color"])
+            rule_symbol.symbolLayer(line_layer_index).setStrokeWidth(rulebook["width"])
+        elif "width" in rulebook:
+            rule_symbol.symbolLayer(line_layer_index).setWidth(rulebook["width"])
+            if line_style == "arrows":
+                rule_symbol.symbolLayer(line_layer_index).setColor(rulebook["color"])
             else:
                 rule_symbol.setColor(rulebook["color"])
+        else:
+            rule_symbol.setColor(rulebook["color"])
 
-            if i > 0:
-                renderer.rootRule().appendChild(rule)
+        return rule
+
+    def _set_map_label(self, layer, field):
         
-        layer.setRenderer(renderer)
+        layer_labeling = QgsVectorLayerSimpleLabeling(self._label_settings(layer, field))
+        layer.setLabelsEnabled(True)
+        layer.setLabeling(layer_labeling)
         layer.triggerRepaint()
 
-    def _set_map_label(self, layer, field):
+    def _label_settings(self, layer, field, style_name=None):
+        """
+        Get label settings of layer
+
+        Args:
+            layer (QgsVectorLayer): layer
+            field (str): label expression
+            style_name (str, optional): name to pick the label style by. Defaults to the name of the layer.
+
+        Returns:
+            QgsPalLayerSettings: label settings
+        """
 
         layer_settings = QgsPalLayerSettings()
         text_format = QgsTextFormat()
@@ -661,29 +1130,31 @@ class MapRefresher:
         buffer_settings.setEnabled(True)
         buffer_settings.setSize(0.5)
         buffer_settings.setColor(QColor("white"))
+
+        style_name = style_name or layer.name()
         
-        if layer.name() == "Prosjekt":
+        if style_name == "Prosjekt":
             layer_settings.minimumScale = 8000
             layer_settings.maximumScale = 2000
             
             layer_settings.priority = 10
             layer_settings.autoWrapLength = 60
             
-        elif "Avløpsledning" in layer.name() or "Vannledning" in layer.name():
+        elif "Avløpsledning" in style_name or "Vannledning" in style_name:
             text_format.setSize(14)
 
             layer_settings.priority = 1        
             layer_settings.minimumScale = 1000
             layer_settings.placement = Qgis.LabelPlacement.Curved
 
-        elif layer.name() == "Bestillinger":
+        elif style_name == "Bestillinger":
             text_format.setSize(14)
 
             layer_settings.priority = 2       
             layer_settings.minimumScale = 1200
             layer_settings.placement = Qgis.LabelPlacement.Curved
 
-        elif layer.name() == "Kum":
+        elif style_name == "Kum":
             text_format.setSize(12)
             
             layer_settings.priority = 10
@@ -705,8 +1176,5 @@ class MapRefresher:
         layer_settings.isExpression = True
         layer_settings.fieldName = field
         layer_settings.enabled = True
-        
-        layer_labeling = QgsVectorLayerSimpleLabeling(layer_settings)
-        layer.setLabelsEnabled(True)
-        layer.setLabeling(layer_labeling)
-        layer.triggerRepaint()
+
+        return layer_settings
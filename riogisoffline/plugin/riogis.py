@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from qgis.core import QgsGeometry, QgsPointXY, QgsFeature, QgsFeatureRequest
+from qgis.core import QgsGeometry, QgsPointXY, QgsFeature, QgsFeatureRequest, QgsProject
 from qgis.gui import QgsMapToolEmitPoint
 from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, Qt
 from qgis.PyQt.QtGui import QIcon, QColor
@@ -19,10 +19,13 @@ from .export_dialog import ExportDialog
 from .upload_dialog import UploadDialog
 from .search_box import SearchBox
 from .multi_thread_job import MultiThreadJob
+from .spatial_index import SpatialIndexCache, ProjectPolygonIndex
+from .project_orders import ProjectOrderIndex
 
 import os.path
 import configparser
 import datetime
+from collections import Counter
 
 import riogisoffline.plugin.utils as utils
 
@@ -58,12 +61,19 @@ class RioGIS:
         # Must be set in initGui() to survive plugin reloads
         self.first_start = None
         self.first_refresh = True
+        self.map_refresher = None
+        self.search_box = None
         self.map_has_been_clicked = False
         self.feature = None
         self.data = None
         self.azure_connection = None
         self.selected_project = None
 
+        # max distance (in meters) from map click to selected feature
+        self.select_feature_tolerance = 10
+        self.spatial_indexes = SpatialIndexCache()
+        self.project_orders = None
+
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
         # noinspection PyTypeChecker,PyArgumentList,PyCallByClass
@@ -117,6 +127,12 @@ class RioGIS:
         # will be set False in run()
         self.first_start = True
 
+        # construct layers hidden at startup when they are checked, also in projects opened directly
+        from .refresh_map import MapRefresher
+
+        self.map_refresher = MapRefresher()
+        self.map_refresher.connect_lazy_layers()
+
     def initiate_gui_elements(self):
         """ Initiates GUI elements the first time the plugin runs """
 
@@ -129,7 +145,7 @@ class RioGIS:
         self.dlg.btnSelectProject.clicked.connect(lambda: self.handle_map_click(self.select_project))
 
         # Refresh map
-        self.dlg.btnReset.clicked.connect(self.refresh_map)
+        self.dlg.btnReset.clicked.connect(lambda: self.refresh_map(rebuild=True))
 
         # Syncronize
         self.dlg.btnSync.clicked.connect(self.run_syncronize_in_background)
@@ -197,9 +213,9 @@ class RioGIS:
         self.dlg.listOrdersInProject.itemClicked.connect(self._list_item_clicked)
         self.all_orders_in_selected_project = None
 
-        # Search
-        search_box = SearchBox(self.dlg, self.iface)
-        search_box.setup()
+        # Search, kept so that searches running in background are not garbage collected
+        self.search_box = SearchBox(self.dlg, self.iface)
+        self.search_box.setup()
 
     def show_necessary_panels(self):
         
@@ -226,6 +242,10 @@ class RioGIS:
             self.iface.removePluginVectorMenu("&RioGIS", action)
             self.iface.removeToolBarIcon(action)
 
+        # a reloaded plugin connects a new refresher, the old one must not handle the signal
+        if self.map_refresher is not None:
+            self.map_refresher.disconnect_lazy_layers()
+
     def setup(self):
         settings = utils.get_settings_path()
         self.settings = utils.load_json(settings)
@@ -304,31 +324,14 @@ class RioGIS:
         feature_layer = "Prosjekt"
         feature_layers = layers if layers else self.iface.mapCanvas().layers()
         self.select_layer(feature_layers, feature_layer)
-        point_click = QgsGeometry.fromPointXY(QgsPointXY(point.x(), point.y()))
 
-        all_features = self.get_all_features_from_all_feature_layers(feature_layers, [feature_layer])
-
-        near_projects = list(
-            filter(
-                lambda feat: point_click.distance(feat.geometry()) == 0,
-                all_features,
-            )
-        )
+        self.selected_project = self.get_smallest_project_containing_point(feature_layers, QgsPointXY(point.x(), point.y()))
 
-        if not near_projects:
+        if not self.selected_project:
             self.dlg.btnChangeProjectStatus.setEnabled(False)
             self.dlg.textSelectedProject.setText("Ingen prosjekter er valgt")
             self.dlg.listOrdersInProject.hide()
             return
-        
-        features_with_meters_in_order = {
-            feat: feat.geometry().area() for feat in near_projects
-        }
-        
-        nearest_feature_distances_list = list(features_with_meters_in_order.values())
-        min_dist = min(nearest_feature_distances_list)
-        idx = nearest_feature_distances_list.index(min_dist)
-        self.selected_project = near_projects[idx]
 
         self.dlg.btnChangeProjectStatus.setEnabled(True)
 
@@ -338,48 +341,57 @@ class RioGIS:
 
         self.show_project_information(self.selected_project)
 
-    def show_project_information(self, project):
+    def get_smallest_project_containing_point(self, layers, point):
         """
-        Show project information in widget
+        Get the project with smallest area that contains point
 
         Args:
-            project (QgsFeature): selected project
+            layers ([QgsVectorLayer]): layers to search in
+            point (QgsPointXY): point
+
+        Returns:
+            QgsFeature: project, or None if no project contains point
         """
 
-        print(project.geometry().area())
+        feature_layer = "Prosjekt"
+        layer_names = [l.name() for l in layers]
 
-        # get all orders in project
-        all_order_features = self.get_layer_by_name("Bestillinger").getFeatures()
+        if feature_layer not in layer_names:
+            return None
 
-        orders_in_project = list(
-            filter(
-                lambda feat: project.geometry().distance(feat.geometry()) == 0 and feat["project_area_id"] == project["project_area_id"],
-                all_order_features,
-            )
-        )
+        layer = layers[layer_names.index(feature_layer)]
+        project_index = self.spatial_indexes.get(layer, ProjectPolygonIndex)
+
+        if project_index:
+            return project_index.smallest_containing(point)
+
+        # layer can not be indexed, test every project
+        point_click = QgsGeometry.fromPointXY(point)
+        near_projects = [feat for feat in layer.getFeatures() if point_click.distance(feat.geometry()) == 0]
+
+        if not near_projects:
+            return None
+
+        return min(near_projects, key=lambda feat: feat.geometry().area())
 
-        completed_total_length = 0
-        cant_inspect_total_length = 0
-        interrupted_total_length = 0
-        spyling_total_length = 0
-        remaining_total_length = 0
+    def show_project_information(self, project):
+        """
+        Show project information in widget
 
+        Args:
+            project (QgsFeature): selected project
+        """
 
-        for order in orders_in_project:
-            length = order["length"]
-            status = order["status_internal"]
+        project_orders = self.get_project_order_index()
+        project_area_id = project["project_area_id"]
 
-            if not length:
-                length = 0
+        # get all orders in project
+        orders_in_project = project_orders.orders(project_area_id)
 
-            if status == 3:
-                cant_inspect_total_length += length
-            elif status == 4:
-                completed_total_length += length
-            elif status == 5:
-                interrupted_total_length += length
-            elif status == 8:
-                spyling_total_length += length
+        cant_inspect_total_length = project_orders.length_total(project_area_id, 3)
+        completed_total_length = project_orders.length_total(project_area_id, 4)
+        interrupted_total_length = project_orders.length_total(project_area_id, 5)
+        spyling_total_length = project_orders.length_total(project_area_id, 8)
 
         meters_in_order = project["meters_in_order"] if project["meters_in_order"] else 0
         remaining_total_length = meters_in_order-completed_total_length
@@ -482,51 +494,108 @@ class RioGIS:
         Args:
             point (point): point
         """
-        point_click = QgsGeometry.fromPointXY(QgsPointXY(point.x(), point.y()))
+        point_xy = QgsPointXY(point.x(), point.y())
+        point_click = QgsGeometry.fromPointXY(point_xy)
 
         feature_names = [self.settings["feature_name"]] + self.settings["other_feature_names"]
-        all_features = self.get_all_features_from_all_feature_layers(layers, feature_names)
+        candidate_features = self.get_features_near_point(layers, feature_names, point_xy, self.select_feature_tolerance)
 
-        near_features = list(
-            filter(
-                lambda feat: point_click.distance(feat.geometry()) < 10 and point_click.distance(feat.geometry()) >= 0,
-                all_features,
-            )
-        )
-        
-        nearest_feature_distances = {
-            feat: point_click.distance(feat.geometry()) for feat in near_features
-        }
+        near_features = []
+        for feat in candidate_features:
+            distance = point_click.distance(feat.geometry())
+            if distance < self.select_feature_tolerance and distance >= 0:
+                near_features.append((feat, distance))
         
         # remove duplicates that is not in layer "Bestilling" so that "Bestilling"-layer is prioritized
-        nearest_feature_distances_without_duplicates = nearest_feature_distances.copy()
-        feature_lsids = [feat["lsid"] for feat in nearest_feature_distances]
-        for feat in nearest_feature_distances:
-            if feature_lsids.count(feat["lsid"]) > 1 and not "orderd_ident" in utils.getFieldNames(feat):
-                del nearest_feature_distances_without_duplicates[feat]
+        lsid_count = Counter(feat["lsid"] for feat, _ in near_features)
+        near_features_without_duplicates = [
+            (feat, distance) for feat, distance in near_features
+            if lsid_count[feat["lsid"]] == 1 or "orderd_ident" in utils.getFieldNames(feat)
+        ]
         
-        if not nearest_feature_distances_without_duplicates:
+        if not near_features_without_duplicates:
             self.feature = None
             return
 
-        nearest_feature_distances_list = list(nearest_feature_distances_without_duplicates.values())
-        min_dist = min(nearest_feature_distances_list)
-        idx = nearest_feature_distances_list.index(min_dist)
-        self.feature = near_features[idx]
+        self.feature, _ = min(near_features_without_duplicates, key=lambda feat_distance: feat_distance[1])
+
+    def get_features_near_point(self, layers, feature_names, point, tolerance):
+        """
+        Get features that may be within tolerance of point. Uses the spatial index
+        of each layer, and falls back to all features if layer has no index.
+
+        Args:
+            layers ([QgsVectorLayer]): layers to search in
+            feature_names ([str]): names of layers to search in
+            point (QgsPointXY): point
+            tolerance (float): search radius in meters
+
+        Returns:
+            [QgsFeature]: candidate features, in order of feature_names
+        """
 
-    def get_all_features_from_all_feature_layers(self, layers, feature_names):
-        
-        # layers with selectable features
         layer_names = [l.name() for l in layers]
 
-        all_features = []
+        candidate_features = []
 
         for name in feature_names:
-            if name in layer_names:
-                index = layer_names.index(name)
-                all_features += layers[index].getFeatures()
-        
-        return all_features
+            if name not in layer_names:
+                continue
+
+            layer = layers[layer_names.index(name)]
+            spatial_index = self.spatial_indexes.get(layer)
+
+            if spatial_index:
+                candidate_features += spatial_index.candidates(point, tolerance)
+            else:
+                candidate_features += layer.getFeatures()
+
+        return candidate_features
+
+    def build_map_indexes(self):
+        """ Build indexes of map layers, so that map clicks and project information only look at relevant features """
+
+        self.spatial_indexes.clear()
+        self.project_orders = None
+
+        feature_names = [self.settings["feature_name"]] + self.settings["other_feature_names"]
+        for name in feature_names:
+            for layer in QgsProject.instance().mapLayersByName(name):
+                self.spatial_indexes.get(layer)
+
+        for layer in QgsProject.instance().mapLayersByName("Prosjekt"):
+            self.spatial_indexes.get(layer, ProjectPolygonIndex)
+
+        self.get_project_order_index()
+
+    def get_project_order_index(self):
+        """
+        Get index of orders in each project, builds it if missing
+
+        Returns:
+            ProjectOrderIndex: index of "Bestillinger"-layer, or None if layer is not loaded
+        """
+
+        layer = self.get_layer_by_name(self.settings["feature_name"])
+
+        if not layer:
+            return None
+
+        if not self.project_orders or self.project_orders.layer.id() != layer.id():
+            self.project_orders = ProjectOrderIndex(layer)
+
+        return self.project_orders
+
+    def update_project_orders(self, order_feature):
+        """
+        Update order in index of orders in each project, after its status has changed
+
+        Args:
+            order_feature (QgsFeature): order feature
+        """
+
+        if self.project_orders:
+            self.project_orders.update_order(order_feature)
 
 
     def update_feature_status(self):
@@ -547,6 +616,7 @@ class RioGIS:
             if int(status) < 4:
                 self.feature["status_internal"] = 2
             self.layer.updateFeature(self.feature)
+            self.update_project_orders(self.feature)
 
             update_project_status = True
 
@@ -567,21 +637,7 @@ class RioGIS:
         feature_layers = self.iface.mapCanvas().layers()
         self.select_layer(feature_layers, feature_layer)
 
-        all_features = self.get_all_features_from_all_feature_layers(feature_layers, [feature_layer])
-
-        near_features = list(
-            filter(
-                lambda feat: feature_in_project.geometry().distance(feat.geometry()) < 10,
-                all_features,
-            )
-        )
-
-        project = None
-
-        for nf in near_features:
-            if nf["project_area_id"] == project_area_id:
-                project = nf
-                break
+        project = self.get_project_by_area_id(feature_layers, project_area_id)
 
         if not project:
             utils.printWarningMessage("Fant ikke tilhørende prosjekt til bestilling")
@@ -592,6 +648,37 @@ class RioGIS:
             comment = ""
             utils.change_project_status(self.settings, self.layer, project, new_status, comment)
 
+    def get_project_by_area_id(self, layers, project_area_id):
+        """
+        Get project with given project_area_id
+
+        Args:
+            layers ([QgsVectorLayer]): layers to search in
+            project_area_id (str): id of project
+
+        Returns:
+            QgsFeature: project, or None if it is not found
+        """
+
+        feature_layer = "Prosjekt"
+        layer_names = [l.name() for l in layers]
+
+        if feature_layer not in layer_names or not project_area_id:
+            return None
+
+        layer = layers[layer_names.index(feature_layer)]
+        project_index = self.spatial_indexes.get(layer, ProjectPolygonIndex)
+
+        if project_index:
+            return project_index.project_by_area_id(project_area_id)
+
+        # layer can not be indexed, test every project
+        for feat in layer.getFeatures():
+            if feat["project_area_id"] == project_area_id:
+                return feat
+
+        return None
+
     def create_new_order_feature(self):
         """
         Create new feature and adds it to "Bestilling"-layer. Copies attributes and geometry from self.feature
@@ -621,6 +708,12 @@ class RioGIS:
         res = self.layer.dataProvider().addFeature(new_feature)
         
         self.layer.updateFeature(new_feature)
+
+        # new feature is not in spatial index, rebuild it on next map click
+        self.spatial_indexes.invalidate(self.layer)
+
+        if self.search_box:
+            self.search_box.add_feature(self.layer, new_feature)
         
         return new_feature 
 
@@ -642,7 +735,13 @@ class RioGIS:
                 data[key] = val
         return data
 
-    def refresh_map(self):
+    def refresh_map(self, rebuild=False):
+        """
+        Load map, or build it if the layers or the source files changed
+
+        Args:
+            rebuild (bool, optional): build map even if saved project is up to date. Defaults to False.
+        """
         
         if not os.path.exists(utils.get_user_settings_path()): 
             utils.printWarningMessage("Legg til bruker-innstillinger (bruker_settings.json)!")
@@ -666,11 +765,21 @@ class RioGIS:
             return
         
         from .refresh_map import MapRefresher 
-        map_refresher = MapRefresher()
-        map_refresher.refresh_map(project_filename)
+
+        # keep refresher, it constructs layers hidden at startup when they are checked
+        if self.map_refresher is None:
+            self.map_refresher = MapRefresher()
+            self.map_refresher.connect_lazy_layers()
+
+        self.map_refresher.refresh_map(project_filename, rebuild)
+
+        self.build_map_indexes()
+
+        if self.search_box:
+            self.search_box.build_index()
 
         if self.first_refresh:
-            map_refresher.zoom_to_extent()
+            self.map_refresher.zoom_to_extent()
             self.first_refresh = False
 
 
@@ -1,9 +1,204 @@
 
-from qgis.core import QgsFeatureRequest, QgsWkbTypes
+from collections import OrderedDict
 
-class SearchBox:
+from qgis.PyQt.QtCore import QObject, Qt, QTimer
+from qgis.PyQt.QtWidgets import QListWidgetItem
+from qgis.core import (
+    QgsApplication,
+    QgsExpression,
+    QgsFeatureRequest,
+    QgsProject,
+    QgsTask,
+    QgsVectorLayer,
+    QgsVectorLayerFeatureSource,
+    QgsWkbTypes,
+)
+
+from .token_index import TokenIndex
+
+
+class SearchResult:
+    """
+    Feature found by search
+
+    Attributes:
+    text : str
+        values of searched attributes, shown in search results
+    layer_id : str
+        id of layer of feature
+    layer_name : str
+        name of layer of feature
+    fid : int
+        feature id
+    bbox : QgsRectangle
+        bounding box of feature
+    is_point : bool
+        True if feature is a point
+    """
+
+    def __init__(self, text, layer_id, layer_name, fid, bbox, is_point):
+        self.text = text
+        self.layer_id = layer_id
+        self.layer_name = layer_name
+        self.fid = fid
+        self.bbox = bbox
+        self.is_point = is_point
+
+
+def search_document(feature, id_attrs, layer_id, layer_name):
+    """
+    Get searched attribute values and search result of feature
+
+    Args:
+        feature (QgsFeature): feature
+        id_attrs ([str]): searched attributes
+        layer_id (str): id of layer of feature
+        layer_name (str): name of layer of feature
+
+    Returns:
+        ([str], SearchResult): values and result, or None if feature has no values or no geometry
+    """
+    values = [str(feature[id_attr]) for id_attr in id_attrs if feature[id_attr]]
+
+    if not values or not feature.hasGeometry():
+        return None
+
+    geometry = feature.geometry()
+    is_point = geometry.type() == QgsWkbTypes.GeometryType.Point
+
+    return values, SearchResult(" ".join(values), layer_id, layer_name, feature.id(), geometry.boundingBox(), is_point)
+
+
+class SearchIndexTask(QgsTask):
+    """
+    Builds a token index of the searched attributes of the searched layers in a background thread
+
+    Attributes:
+    index : TokenIndex
+        index of SearchResult
+    layer_ids : set
+        ids of indexed layers
+    """
+
+    def __init__(self, layers, on_finished):
+        """
+        Args:
+            layers ([(QgsVectorLayer, [str])]): layers and their searched attributes
+            on_finished (function): function(task, result) called in main thread when task is finished
+        """
+        super().__init__("Bygger søkeindeks", QgsTask.CanCancel | QgsTask.Hidden)
+
+        self.on_finished = on_finished
+        self.index = None
+        self.layer_ids = {layer.id() for layer, _ in layers}
+
+        self.sources = []
+
+        # sources must be created in main thread, but can be read from any thread
+        for layer, id_attrs in layers:
+            id_attrs = [id_attr for id_attr in id_attrs if layer.fields().indexOf(id_attr) >= 0]
+
+            if not id_attrs:
+                continue
+
+            request = QgsFeatureRequest().setSubsetOfAttributes(id_attrs, layer.fields())
+            self.sources.append((layer.id(), layer.name(), id_attrs, QgsVectorLayerFeatureSource(layer), request))
+
+    def run(self):
+        documents = []
+
+        for layer_id, layer_name, id_attrs, source, request in self.sources:
+            for feature in source.getFeatures(request):
+                if self.isCanceled():
+                    return False
+
+                document = search_document(feature, id_attrs, layer_id, layer_name)
+
+                if document:
+                    documents.append(document)
+
+        self.index = TokenIndex(documents)
+
+        return True
+
+    def finished(self, result):
+        self.on_finished(self, result)
+
+
+class LayerSearchTask(QgsTask):
+    """
+    Searches one layer for features with an attribute starting with the search text.
+    Features are read from a feature source of the layer, so the search runs in a
+    background thread without touching the layer.
+
+    Attributes:
+    layer_name : str
+        name of searched layer
+    generation : int
+        number of the search the task is part of
+    cache_generation : int
+        number of the search index the results may be cached with
+    results : [SearchResult]
+        found features
+    """
+
+    def __init__(self, layer, id_attr, text, max_features, generation, cache_generation, on_finished):
+        super().__init__(f"Søk i {layer.name()}", QgsTask.CanCancel | QgsTask.Hidden)
+
+        self.layer_id = layer.id()
+        self.layer_name = layer.name()
+        self.text = text
+        self.id_attr = id_attr
+        self.generation = generation
+        self.cache_generation = cache_generation
+        self.on_finished = on_finished
+        self.results = []
+
+        # source must be created in main thread, but can be read from any thread
+        self.source = QgsVectorLayerFeatureSource(layer)
+
+        # Requests features that start with text
+        self.request = QgsFeatureRequest().setFilterExpression(f'LOWER("{id_attr}") LIKE LOWER({QgsExpression.quotedString(text + "%")})')
+        self.request.setSubsetOfAttributes([id_attr], layer.fields())
+        self.request.setLimit(max_features)
+
+    def run(self):
+        for feature in self.source.getFeatures(self.request):
+            if self.isCanceled():
+                return False
+
+            if not feature.hasGeometry():
+                continue
+
+            geometry = feature.geometry()
+            is_point = geometry.type() == QgsWkbTypes.GeometryType.Point
+            result = SearchResult(str(feature[self.id_attr]), self.layer_id, self.layer_name, feature.id(), geometry.boundingBox(), is_point)
+
+            self.results.append(result)
+
+        return True
+
+    def finished(self, result):
+        self.on_finished(self, result)
+
+
+class SearchBox(QObject):
+    """
+    Searches layers on the map as the user types. A search starts when the user has
+    stopped typing for search_delay milliseconds.
+
+    A token index of the searched attributes is built in the background when the map
+    is loaded. Searches are ranked lookups in it, and can contain several words and
+    misspelled words. Until it is built, searches run one background prefix search
+    task per layer. Results are shown as each layer is searched, and
+    searches for text that is no longer in the search box are canceled. Results
+    of the latest searches of each layer are cached, so they are shown at once
+    when the same text is searched again.
+    """
 
     def __init__(self, dlg, iface):
+        super().__init__()
+
         self.dlg = dlg
         self.iface = iface
 
@@ -11,14 +206,32 @@ class SearchBox:
 
         self.charatcters_written_until_search = 2
         self.max_features = 5
-        self.split_char = "-"
+        self.max_results = 15
+        self.result_cache_size = 100
+        self.search_delay = 250
+
+        self._text = ""
+        self._generation = 0
+        self._tasks = []
+        self._index = None
+        self._indexed_layer_ids = set()
+        self._index_task = None
+
+        # (layer id, text) -> [SearchResult], least recently used first
+        self._result_cache = OrderedDict()
+        self._cache_generation = 0
 
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.search)
+
+        # searched attributes of layers, the first is searched before the index is built
         self.search_layers = {
-            "kum": "psid",
-            "Bestillinger": "lsid",
-            "Prosjekt": "project_name",
-            "ledning": "lsid",
-            "Tekst": "STRENG",
+            "kum": ["psid"],
+            "Bestillinger": ["lsid", "streetname", "fcode"],
+            "Prosjekt": ["project_name"],
+            "ledning": ["lsid", "streetname", "fcode"],
+            "Tekst": ["STRENG"],
         }
 
     def setup(self):
@@ -28,53 +241,205 @@ class SearchBox:
 
     def onTextChanged(self, text):
         self.dlg.searchResults.clear()
+        self._cancel_search()
+
+        self._text = text
 
         if not text or len(text) < self.charatcters_written_until_search:
+            self._timer.stop()
             return
 
-        canvas = self.iface.mapCanvas()
+        # restart timer, so search only starts when user stops typing
+        self._timer.start(self.search_delay)
 
-        for layer_name, layer_id_attr in self.search_layers.items():
-            
-            layers = [l for l in canvas.layers() if l.name() == layer_name or layer_name in l.name().lower()]
+    def build_index(self):
+        """
+        Build token index of searched layers in project, in background
+        """
+        if self._index_task:
+            self._index_task.cancel()
 
-            for layer in layers:
-                # Requests features that start with text
-                request = QgsFeatureRequest().setFilterExpression(f'LOWER("{layer_id_attr}") LIKE LOWER(\'{text}%\')')
+        self._index = None
+        self._indexed_layer_ids = set()
 
-                request_results = layer.getFeatures(request)
+        # cached results can have features that have moved or been replaced
+        self._result_cache.clear()
+        self._cache_generation += 1
 
-                for i, feature in enumerate(request_results):
-                    if i >= self.max_features:
-                        break
+        layers = list(self._searched_layers(QgsProject.instance().mapLayers().values()))
 
-                    self.dlg.searchResults.addItem(f"{str(feature[layer_id_attr])}  {self.split_char} {layer.name()}")
+        self._index_task = SearchIndexTask(layers, self._handle_index_finished)
+        QgsApplication.taskManager().addTask(self._index_task)
 
-    def onItemClicked(self, item):
+    def _handle_index_finished(self, task, result):
+        if task is not self._index_task:
+            return
+
+        self._index_task = None
+
+        if result:
+            self._index = task.index
+            self._indexed_layer_ids = task.layer_ids
+
+    def add_feature(self, layer, feature):
+        """
+        Add feature added to layer to the index, instead of rebuilding it
+
+        Args:
+            layer (QgsVectorLayer): layer of feature
+            feature (QgsFeature): added feature
+        """
+        id_attrs = next((id_attrs for _, id_attrs in self._searched_layers([layer])), None)
+
+        if id_attrs is None:
+            return
+
+        # cached results of the layer, and of searches running now, are missing the feature
+        for key in [key for key in self._result_cache if key[0] == layer.id()]:
+            del self._result_cache[key]
+
+        self._cache_generation += 1
+
+        # the index being built may or may not have read the feature
+        if self._index_task:
+            self.build_index()
+            return
+
+        if self._index is None or layer.id() not in self._indexed_layer_ids:
+            return
+
+        id_attrs = [id_attr for id_attr in id_attrs if layer.fields().indexOf(id_attr) >= 0]
+        document = search_document(feature, id_attrs, layer.id(), layer.name())
+
+        if document:
+            self._index.add(*document)
+
+    def _searched_layers(self, layers):
+        """
+        Get layers to search, in order of search_layers
+
+        Args:
+            layers ([QgsMapLayer]): layers
+
+        Yields:
+            (QgsVectorLayer, [str]): layer and searched attributes
+        """
+        layers = list(layers)
+
+        for layer_name, layer_id_attrs in self.search_layers.items():
+            for layer in layers:
+                if not isinstance(layer, QgsVectorLayer):
+                    continue
+
+                if layer.name() == layer_name or layer_name in layer.name().lower():
+                    yield layer, layer_id_attrs
+
+    def search(self):
         canvas = self.iface.mapCanvas()
-        
-        split_item_text = item.text().split(self.split_char)
-        if len(split_item_text) == 2:
-            text = item.text().split(self.split_char)[0].strip()
-        else:
-             text = self.split_char.join(split_item_text[:-1]).strip()
+        layers = list(self._searched_layers(canvas.layers()))
+
+        if self._index is not None:
+            # only show results from layers shown on map
+            layer_ids = {layer.id() for layer, _ in layers}
+
+            for result in self._index.search(self._text, self.max_results, lambda result: result.layer_id in layer_ids):
+                self._add_result(result)
+
+            layers = [(layer, id_attrs) for layer, id_attrs in layers if layer.id() not in self._indexed_layer_ids]
+
+        for layer, layer_id_attrs in layers:
+            cached_results = self._cached_results(layer.id(), self._text)
 
-        layer_name = item.text().split(self.split_char)[-1].strip()
+            if cached_results is not None:
+                for result in cached_results:
+                    self._add_result(result)
+                continue
 
-        layer_id_attr = [id_attr for l_name, id_attr in self.search_layers.items() if l_name.lower() in layer_name.lower()][0]
+            task = LayerSearchTask(
+                layer,
+                layer_id_attrs[0],
+                self._text,
+                self.max_features,
+                self._generation,
+                self._cache_generation,
+                self._handle_search_finished,
+            )
 
-        layers = [l for l in canvas.layers() if l.name() == layer_name]
+            self._tasks.append(task)
+            QgsApplication.taskManager().addTask(task)
 
-        if not layers:
+    def _add_result(self, result):
+        item = QListWidgetItem(f"{result.text}  - {result.layer_name}")
+
+        # bounding box is used to zoom to feature when item is clicked
+        item.setData(Qt.UserRole, result)
+
+        self.dlg.searchResults.addItem(item)
+
+    def _cancel_search(self):
+        self._generation += 1
+
+        for task in self._tasks:
+            task.cancel()
+
+    def _handle_search_finished(self, task, result):
+        if task in self._tasks:
+            self._tasks.remove(task)
+
+        if not result:
             return
-        
-        layer = layers[0]
-            
-        request = QgsFeatureRequest().setFilterExpression(f'"{layer_id_attr}" = \'{text}\'')
-        feature = next(layer.getFeatures(request))
 
-        if feature.geometry().type() == QgsWkbTypes.GeometryType.Point:
+        # results of tasks started before the index was rebuilt are not cached
+        if task.cache_generation == self._cache_generation:
+            self._cache_results(task.layer_id, task.text, task.results)
+
+        # text has changed since task started
+        if task.generation != self._generation:
+            return
+
+        for search_result in task.results:
+            self._add_result(search_result)
+
+    def _cached_results(self, layer_id, text):
+        """
+        Get results of earlier search of layer
+
+        Args:
+            layer_id (str): id of layer
+            text (str): search text
+
+        Returns:
+            [SearchResult]: results, or None if not cached
+        """
+        key = (layer_id, text.lower())
+
+        if key not in self._result_cache:
+            return None
+
+        self._result_cache.move_to_end(key)
+
+        return self._result_cache[key]
+
+    def _cache_results(self, layer_id, text, results):
+        self._result_cache[(layer_id, text.lower())] = results
+        self._result_cache.move_to_end((layer_id, text.lower()))
+
+        while len(self._result_cache) > self.result_cache_size:
+            self._result_cache.popitem(last=False)
+
+    def onItemClicked(self, item):
+        result = item.data(Qt.UserRole)
+
+        if not isinstance(result, SearchResult):
+            return
+
+        self._zoom_to(result.bbox, result.is_point)
+
+    def _zoom_to(self, bbox, is_point):
+        canvas = self.iface.mapCanvas()
+
+        if is_point:
             canvas.zoomScale(self.zoom_level_for_point)
         
-        canvas.setExtent(feature.geometry().boundingBox())
+        canvas.setExtent(bbox)
         canvas.refresh()
\ No newline at end of file
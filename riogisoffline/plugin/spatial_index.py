@@ -0,0 +1,217 @@
+from qgis.core import QgsFeatureRequest, QgsGeometry, QgsRectangle, QgsSpatialIndex, QgsVectorLayer
+
+
+class LayerSpatialIndex:
+    """
+    Spatial index over the features of one vector layer
+
+    Only feature ids and bounding boxes are kept in memory. Candidate features
+    are fetched from the layer when queried, so attribute changes made after
+    the index was built are always visible.
+
+    Attributes:
+    layer : QgsVectorLayer
+        indexed layer
+    """
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.index = QgsSpatialIndex()
+
+        for feature in layer.getFeatures(self.feature_request()):
+            self.add_feature(feature)
+
+    def feature_request(self):
+        """
+        Get request used to read features when building index
+
+        Returns:
+            QgsFeatureRequest: request
+        """
+        return QgsFeatureRequest().setNoAttributes()
+
+    def add_feature(self, feature):
+        """
+        Add feature to index
+
+        Args:
+            feature (QgsFeature): feature with geometry
+        """
+        if feature.hasGeometry():
+            self.index.addFeature(feature)
+
+    def candidate_ids(self, point, tolerance):
+        """
+        Get ids of features with bounding box within tolerance of point
+
+        Args:
+            point (QgsPointXY): point
+            tolerance (float): search radius in map units
+
+        Returns:
+            [int]: sorted list of feature ids
+        """
+        search_rectangle = QgsRectangle(
+            point.x() - tolerance,
+            point.y() - tolerance,
+            point.x() + tolerance,
+            point.y() + tolerance,
+        )
+
+        return sorted(self.index.intersects(search_rectangle))
+
+    def candidates(self, point, tolerance):
+        """
+        Get features with bounding box within tolerance of point
+
+        Args:
+            point (QgsPointXY): point
+            tolerance (float): search radius in map units
+
+        Returns:
+            [QgsFeature]: candidate features
+        """
+        ids = self.candidate_ids(point, tolerance)
+
+        if not ids:
+            return []
+
+        return list(self.layer.getFeatures(QgsFeatureRequest().setFilterFids(ids)))
+
+
+class ProjectPolygonIndex(LayerSpatialIndex):
+    """
+    Spatial index over project polygons, used to find the projects containing a point
+
+    A prepared geometry engine and the area of each polygon are computed when the
+    index is built, so a query only runs exact tests on polygons with a
+    bounding box containing the point. Projects can also be looked up
+    directly by project_area_id.
+    """
+
+    def __init__(self, layer):
+        self._geometries = {}
+        self._engines = {}
+        self._areas = {}
+        self._ids_by_project_area_id = {}
+
+        super().__init__(layer)
+
+    def feature_request(self):
+        return QgsFeatureRequest().setSubsetOfAttributes(["project_area_id"], self.layer.fields())
+
+    def add_feature(self, feature):
+        super().add_feature(feature)
+
+        if feature["project_area_id"]:
+            self._ids_by_project_area_id[feature["project_area_id"]] = feature.id()
+
+        if not feature.hasGeometry():
+            return
+
+        # keep geometry, the engine only holds a reference to it
+        geometry = QgsGeometry(feature.geometry())
+        engine = QgsGeometry.createGeometryEngine(geometry.constGet())
+        engine.prepareGeometry()
+
+        self._geometries[feature.id()] = geometry
+        self._engines[feature.id()] = engine
+        self._areas[feature.id()] = geometry.area()
+
+    def containing_ids(self, point):
+        """
+        Get ids of polygons that contain (or touch) point
+
+        Args:
+            point (QgsPointXY): point
+
+        Returns:
+            [int]: feature ids, smallest polygon first
+        """
+        point_geometry = QgsGeometry.fromPointXY(point)
+
+        ids = [
+            fid for fid in self.candidate_ids(point, 0)
+            if self._engines[fid].intersects(point_geometry.constGet())
+        ]
+
+        return sorted(ids, key=lambda fid: self._areas[fid])
+
+    def smallest_containing(self, point):
+        """
+        Get smallest polygon that contains point
+
+        Args:
+            point (QgsPointXY): point
+
+        Returns:
+            QgsFeature: project feature, or None if no polygon contains point
+        """
+        ids = self.containing_ids(point)
+
+        if not ids:
+            return None
+
+        return self.layer.getFeature(ids[0])
+
+    def project_by_area_id(self, project_area_id):
+        """
+        Get project with given project_area_id
+
+        Args:
+            project_area_id (str): id of project
+
+        Returns:
+            QgsFeature: project feature, or None if there is no such project
+        """
+        fid = self._ids_by_project_area_id.get(project_area_id)
+
+        if fid is None:
+            return None
+
+        return self.layer.getFeature(fid)
+
+
+class SpatialIndexCache:
+    """
+    Keeps one spatial index per layer. Indexes are built the first time a layer
+    is queried and dropped when the map is refreshed.
+    """
+
+    def __init__(self):
+        self._indexes = {}
+
+    def get(self, layer, index_class=LayerSpatialIndex):
+        """
+        Get spatial index of layer, builds it if missing
+
+        Args:
+            layer (QgsVectorLayer): layer to index
+            index_class (type, optional): LayerSpatialIndex or subclass. Defaults to LayerSpatialIndex.
+
+        Returns:
+            LayerSpatialIndex: index, or None if layer can not be indexed
+        """
+        if not isinstance(layer, QgsVectorLayer) or not layer.isValid():
+            return None
+
+        index = self._indexes.get(layer.id())
+
+        if not isinstance(index, index_class):
+            index = index_class(layer)
+            self._indexes[layer.id()] = index
+
+        return index
+
+    def invalidate(self, layer):
+        """
+        Drop index of layer so that it is rebuilt on next query
+
+        Args:
+            layer (QgsVectorLayer): layer
+        """
+        if isinstance(layer, QgsVectorLayer):
+            self._indexes.pop(layer.id(), None)
+
+    def clear(self):
+        self._indexes = {}
@@ -0,0 +1,179 @@
+import csv
+import os
+import sqlite3
+from contextlib import closing
+
+
+class StatusJournal:
+    """
+    Journal of status changes made offline, kept in a SQLite database in WAL mode
+
+    Only the last change of each order (lsid, project_area_id) and each project
+    (GlobalID) is kept. Changes are numbered in the order they are written, so
+    changes made while earlier changes are uploaded are not removed with them.
+
+    Attributes:
+    path : str
+        path to database file
+    """
+
+    ORDER_STATUS = "order_status_changes"
+    PROJECT_STATUS = "project_status_changes"
+
+    # fields of changes in each table, as uploaded
+    FIELDS = {
+        ORDER_STATUS: ["lsid", "new_status", "comment", "project_area_id"],
+        PROJECT_STATUS: ["GlobalID", "new_status", "comments_inspector"],
+    }
+
+    _SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS order_status_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, lsid, new_status, comment, project_area_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS order_status_changes_key ON order_status_changes (lsid, IFNULL(project_area_id, ''))",
+        "CREATE TABLE IF NOT EXISTS project_status_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, GlobalID, new_status, comments_inspector)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS project_status_changes_key ON project_status_changes (GlobalID)",
+    ]
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        is_new = not os.path.exists(self.path)
+
+        connection = sqlite3.connect(self.path, timeout=10)
+
+        if is_new:
+            # WAL mode is persistent, so it is only set when database is created
+            connection.execute("PRAGMA journal_mode=WAL")
+
+        # tables are also created in files left empty by a failed first connect
+        with connection:
+            for statement in self._SCHEMA:
+                connection.execute(statement)
+
+        return connection
+
+    def write(self, table, change):
+        """
+        Write status change, replacing earlier change of the same order or project
+
+        Args:
+            table (str): ORDER_STATUS or PROJECT_STATUS
+            change (dict): field -> value, with the fields in FIELDS[table]
+        """
+        self.write_many(table, [change])
+
+    def write_many(self, table, changes):
+        """
+        Write status changes in one transaction
+
+        Args:
+            table (str): ORDER_STATUS or PROJECT_STATUS
+            changes ([dict]): status changes, in the order they were made
+        """
+        fields = self.FIELDS[table]
+
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(fields)}) VALUES ({', '.join('?' for _ in fields)})",
+                [[self._sql_value(change[field]) for field in fields] for change in changes],
+            )
+
+    def changes(self, table, after_seq=0):
+        """
+        Read status changes
+
+        Args:
+            table (str): ORDER_STATUS or PROJECT_STATUS
+            after_seq (int, optional): only read changes written after change with this number. Defaults to 0.
+
+        Returns:
+            [(int, dict)]: number and fields of changes, in the order they were written
+        """
+        if not os.path.exists(self.path):
+            return []
+
+        fields = self.FIELDS[table]
+
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f"SELECT seq, {', '.join(fields)} FROM {table} WHERE seq > ? ORDER BY seq",
+                (after_seq,),
+            )
+
+            return [(row[0], dict(zip(fields, row[1:]))) for row in rows]
+
+    def has_changes(self, table=None):
+        """
+        Check if there are status changes
+
+        Args:
+            table (str, optional): ORDER_STATUS or PROJECT_STATUS. Checks both if None. Defaults to None.
+
+        Returns:
+            bool: True if there are changes
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        tables = [table] if table else list(self.FIELDS)
+
+        with closing(self._connect()) as connection:
+            return any(connection.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() for table in tables)
+
+    def remove(self, table, up_to_seq):
+        """
+        Remove status changes, e.g. when they are uploaded
+
+        Args:
+            table (str): ORDER_STATUS or PROJECT_STATUS
+            up_to_seq (int): remove changes with this number or lower
+        """
+        with closing(self._connect()) as connection, connection:
+            connection.execute(f"DELETE FROM {table} WHERE seq <= ?", (up_to_seq,))
+
+    def import_csv(self, filepath, table):
+        """
+        Move status changes from csv-file written by earlier versions into journal, and remove file
+
+        Args:
+            filepath (str): path to csv-file
+            table (str): ORDER_STATUS or PROJECT_STATUS
+        """
+        if not os.path.exists(filepath):
+            return
+
+        fields = self.FIELDS[table]
+
+        with open(filepath, "r", newline="", encoding="utf-8") as f:
+            changes = [
+                {field: self._csv_value(row.get(field)) for field in fields}
+                for row in csv.DictReader(f)
+                # header is repeated if file was written by several versions
+                if row.get(fields[0]) != fields[0]
+            ]
+
+        self.write_many(table, changes)
+
+        os.remove(filepath)
+
+    @staticmethod
+    def _sql_value(value):
+        if value is None or isinstance(value, (int, float, str)):
+            return value
+
+        # NULL attribute values from layers
+        if not value:
+            return None
+
+        return str(value)
+
+    @staticmethod
+    def _csv_value(value):
+        # empty values and numbers are read as by pandas.read_csv
+        if value is None or value == "":
+            return None
+
+        if value.lstrip("-").isdigit():
+            return int(value)
+
+        return value
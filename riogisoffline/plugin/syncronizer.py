@@ -3,10 +3,11 @@ import hashlib
 import os
 import requests
 import json
-import pandas as pd
 
-from qgis.core import QgsVectorLayer, QgsVectorLayerEditBufferGroup
+from qgis.core import QgsFeature, QgsVectorLayer, QgsVectorLayerEditBufferGroup
 import riogisoffline.plugin.utils as utils
+from .ranged_download import RangedDownload
+from .status_journal import StatusJournal
 
 class Syncronizer:
     def __init__(self, worker, azure_connection):
@@ -20,8 +21,7 @@ class Syncronizer:
         # read builtin-settings
         settings = utils.load_json(self._settings)
         self._layer_definitions = settings["layer_definitions"]
-        self.changed_status_filename = settings["changed_status_filename"]
-        self.changed_project_status_filename = settings["changed_project_status_filename"]
+        self._layer_keys = settings["layer_keys"]
         
         # read user settings
         user_settings = utils.load_json(self._user_settings)
@@ -34,11 +34,11 @@ class Syncronizer:
         bg_file = self._background_url.split("/")[-1]
         root, ext = os.path.splitext(self._filename)
         self._up_filename = root + "_update" + ext
+        self._digest_cache_filename = root + "_digest.json"
         self._bg_filename = os.path.join(self._filepath, bg_file)
         self.azure_key = user_settings["azure_key"]
 
-        self.changed_status_filepath = os.path.join(self._filepath, self.changed_status_filename)
-        self.changed_project_status_filepath = os.path.join(self._filepath, self.changed_project_status_filename)
+        self._status_journal = utils.get_status_journal(self._filepath, settings)
 
     def _download(self, url, filename):
 
@@ -48,6 +48,29 @@ class Syncronizer:
 
         self.signal_new_process_name(f"Laster ned {short_file_name}...")
 
+        head_response = requests.head(url, allow_redirects=True, timeout=60)
+        size = int(head_response.headers.get("Content-Length", 0))
+
+        # download in a single stream if server does not support ranges
+        if head_response.status_code != 200 or not size or head_response.headers.get("Accept-Ranges") != "bytes":
+            self._download_stream(url, filename)
+            return
+
+        def fetch_range(start, end):
+            response = requests.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=60)
+            if response.status_code != 206:
+                raise IOError(f"Failed to download bytes {start}-{end} of {url}: {response.status_code}")
+            return response.content
+
+        # resumes earlier download of the same file
+        validator = head_response.headers.get("ETag") or head_response.headers.get("Last-Modified")
+        download = RangedDownload(fetch_range, size, filename, self.signal_progress, validator=validator)
+        download.run()
+
+        self.signal_progress(100)
+
+    def _download_stream(self, url, filename):
+
         response = requests.get(url, stream=True)
         if response.status_code != 200:
             self.signal_warning_message(f"Failed to download the new file {filename} from {url}")
@@ -127,14 +150,93 @@ class Syncronizer:
         return False
 
     @staticmethod
-    def _equal(file1, file2):
-        with open(file1, "rb") as f1:
-            with open(file2, "rb") as f2:
-                h1 = hashlib.new("md5")
-                h2 = hashlib.new("md5")
-                h1.update(f1.read())
-                h2.update(f2.read())
-                return h1.hexdigest() == h2.hexdigest()
+    def _block_digests(filename, block_size):
+        """
+        Read file one block at a time and yield md5 hex digest of each block
+
+        Args:
+            filename (str): path to file
+            block_size (int): number of bytes in each block
+
+        Yields:
+            str: md5 hex digest of block
+        """
+        with open(filename, "rb") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                yield hashlib.md5(block).hexdigest()
+
+    @staticmethod
+    def _read_digest_cache(filename, digest_cache_filename, block_size):
+        """
+        Read cached block digests of file, if file is unchanged since they were cached
+
+        Returns:
+            [str]: md5 hex digest of each block, or None if there is no valid cache
+        """
+        if not digest_cache_filename or not os.path.exists(digest_cache_filename):
+            return None
+
+        try:
+            with open(digest_cache_filename, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        stat = os.stat(filename)
+
+        if cache.get("size") != stat.st_size or cache.get("mtime") != stat.st_mtime or cache.get("block_size") != block_size:
+            return None
+
+        return cache.get("digests")
+
+    @staticmethod
+    def _write_digest_cache(filename, digest_cache_filename, block_size, digests):
+        stat = os.stat(filename)
+
+        cache = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "block_size": block_size,
+            "digests": digests,
+        }
+
+        with open(digest_cache_filename, "w") as f:
+            json.dump(cache, f)
+
+    @staticmethod
+    def _equal(file1, file2, digest_cache_filename=None, block_size=8*1024*1024):
+        """
+        Compare content of two files, one block at a time. Stops at the first block that differs.
+
+        Args:
+            file1 (str): path to first file (digests of this file are cached)
+            file2 (str): path to second file
+            digest_cache_filename (str, optional): path to cache of block digests of file1. Defaults to None.
+            block_size (int, optional): number of bytes read at a time. Defaults to 8 MB.
+
+        Returns:
+            bool: True if files are equal
+        """
+        if os.path.getsize(file1) != os.path.getsize(file2):
+            return False
+
+        cached_digests = Syncronizer._read_digest_cache(file1, digest_cache_filename, block_size)
+        digests1 = cached_digests if cached_digests is not None else Syncronizer._block_digests(file1, block_size)
+
+        read_digests = []
+
+        for digest1, digest2 in zip(digests1, Syncronizer._block_digests(file2, block_size)):
+            if digest1 != digest2:
+                return False
+            read_digests.append(digest1)
+
+        if cached_digests is None and digest_cache_filename:
+            Syncronizer._write_digest_cache(file1, digest_cache_filename, block_size, read_digests)
+
+        return True
 
     def _update(self, active_layer_name):
 
@@ -164,55 +266,24 @@ class Syncronizer:
             self.signal_warning_message(f"Failed to load the layer from {file2_path}")
             return
         
-        active_layer.startEditing()
-
-        feature_id = 0
-        new_features = []
-    
-        listOfIds = [feat.id() for feat in active_layer.getFeatures()]
-        active_layer.deleteFeatures( listOfIds )
+        new_features = list(second_layer.getFeatures())
 
         self.signal_progress(10)
+        
+        # keep status changes made offline that are not uploaded yet
+        self._apply_local_status_changes(active_layer_name, new_features)
 
-        # Iterate through features in second_layer
-        for feature in second_layer.getFeatures():
-            feature.setAttribute(0, feature_id)
-            feature.setId(feature_id)
+        self.signal_progress(30)
 
-            feature_id +=1
-            
-            new_features.append(feature)
-        
-        if active_layer_name == "Bestillinger" and os.path.exists(self.changed_status_filepath):
-            changed_status_df = pd.read_csv(self.changed_status_filepath)
-        
-            for _, row in changed_status_df.iterrows():
-                lsid = row["lsid"]
-                project_area_id = row["project_area_id"]
-                status = row["new_status"]
-
-                feature_to_change = [feat for feat in new_features if feat["lsid"] == lsid and feat["project_area_id"] == project_area_id]
-
-                if feature_to_change:
-                    feature = feature_to_change[0]
-                    
-                    feature["status_internal"] = status
-        elif active_layer_name == "Prosjekt" and os.path.exists(self.changed_project_status_filepath):
-            changed_project_status_df = pd.read_csv(self.changed_project_status_filepath)
-        
-            for _, row in changed_project_status_df.iterrows():
-                project_area_id = row["GlobalID"]
-                status = row["new_status"]
+        active_layer.startEditing()
 
-                feature_to_change = [feat for feat in new_features if feat["project_area_id"] == project_area_id]
+        key_fields = self._layer_keys.get(active_layer_name)
 
-                if feature_to_change:
-                    feature = feature_to_change[0]
-                    
-                    feature["status"] = status
-                    
-        # Add the feature to the active layer
-        active_layer.addFeatures(new_features)
+        if key_fields and self._has_same_fields(active_layer, second_layer, key_fields):
+            merge_counts = self._merge_features(active_layer, new_features, key_fields)
+            self._merge_counts = [total + count for total, count in zip(self._merge_counts or [0, 0, 0], merge_counts)]
+        else:
+            self._replace_features(active_layer, new_features)
 
         # Commit the changes to the active layer immediately
         active_layer.commitChanges()
@@ -224,6 +295,165 @@ class Syncronizer:
 
         return active_layer
 
+    def _read_local_status_changes(self, table, key_columns):
+        """
+        Read status changes made offline from journal
+
+        Args:
+            table (str): StatusJournal.ORDER_STATUS or StatusJournal.PROJECT_STATUS
+            key_columns ([str]): columns that identifies changed feature
+
+        Returns:
+            dict: key of changed feature -> new status
+        """
+
+        return {
+            tuple(self._key_value(status_change[column]) for column in key_columns): int(status_change["new_status"])
+            for _, status_change in self._status_journal.changes(table)
+        }
+
+    def _apply_local_status_changes(self, layer_name, new_features):
+        """
+        Set status of changed features in new_features to the status changed offline
+
+        Args:
+            layer_name (str): name of layer
+            new_features ([QgsFeature]): features from updated db
+        """
+
+        if layer_name == "Bestillinger":
+            table = StatusJournal.ORDER_STATUS
+            key_columns = ["lsid", "project_area_id"]
+            key_fields = ["lsid", "project_area_id"]
+            status_field = "status_internal"
+        elif layer_name == "Prosjekt":
+            table = StatusJournal.PROJECT_STATUS
+            key_columns = ["GlobalID"]
+            key_fields = ["project_area_id"]
+            status_field = "status"
+        else:
+            return
+
+        new_statuses = self._read_local_status_changes(table, key_columns)
+
+        if not new_statuses:
+            return
+
+        for feature in new_features:
+            new_status = new_statuses.get(self._feature_key(feature, key_fields))
+
+            if new_status is not None:
+                feature[status_field] = new_status
+
+    @staticmethod
+    def _has_same_fields(layer1, layer2, key_fields):
+        """
+        Check that layers have the same fields, and that key fields exist
+
+        Returns:
+            bool: True if features can be compared field by field
+        """
+        field_names = utils.getFieldNames(layer1)
+
+        return field_names == utils.getFieldNames(layer2) and all(field in field_names for field in key_fields)
+
+    @staticmethod
+    def _key_value(value):
+        # None from the journal, NULL attribute values from layers and empty strings are the same key
+        if value is None or value == "" or (not isinstance(value, (int, float, str)) and not value):
+            return ""
+
+        return str(value)
+
+    @classmethod
+    def _feature_key(cls, feature, key_fields):
+        return tuple(cls._key_value(feature[field]) for field in key_fields)
+
+    def _merge_features(self, layer, new_features, key_fields):
+        """
+        Insert, update and delete features in layer so that it matches new_features.
+        Features are matched on key_fields, and only changed features are written.
+        Layer must be in edit mode.
+
+        Args:
+            layer (QgsVectorLayer): local layer
+            new_features ([QgsFeature]): features from updated db
+            key_fields ([str]): fields that identifies a feature
+
+        Returns:
+            (int, int, int): number of added, updated and deleted features
+        """
+
+        pk_indexes = layer.dataProvider().pkAttributeIndexes() or [0]
+        compare_indexes = [i for i in range(len(layer.fields())) if i not in pk_indexes]
+
+        local_features = {}
+        for feature in layer.getFeatures():
+            local_features.setdefault(self._feature_key(feature, key_fields), []).append(feature)
+
+        features_to_add = []
+        updated_count = 0
+
+        for new_feature in new_features:
+            matching_features = local_features.get(self._feature_key(new_feature, key_fields))
+
+            if not matching_features:
+                feature = QgsFeature(layer.fields())
+                feature.setAttributes(new_feature.attributes())
+
+                # let the provider assign a new fid
+                for i in pk_indexes:
+                    feature.setAttribute(i, None)
+
+                feature.setGeometry(new_feature.geometry())
+                features_to_add.append(feature)
+                continue
+
+            local_feature = matching_features.pop(0)
+
+            changed_attributes = {
+                i: new_feature.attribute(i) for i in compare_indexes
+                if new_feature.attribute(i) != local_feature.attribute(i)
+            }
+            is_geometry_changed = local_feature.geometry().asWkb() != new_feature.geometry().asWkb()
+
+            if not changed_attributes and not is_geometry_changed:
+                continue
+
+            if changed_attributes:
+                layer.changeAttributeValues(local_feature.id(), changed_attributes)
+
+            if is_geometry_changed:
+                layer.changeGeometry(local_feature.id(), new_feature.geometry())
+
+            updated_count += 1
+
+        ids_to_delete = [feature.id() for features in local_features.values() for feature in features]
+
+        layer.deleteFeatures(ids_to_delete)
+        layer.addFeatures(features_to_add)
+
+        return len(features_to_add), updated_count, len(ids_to_delete)
+
+    @staticmethod
+    def _replace_features(layer, new_features):
+        """
+        Replace all features in layer with new_features. Layer must be in edit mode.
+
+        Args:
+            layer (QgsVectorLayer): local layer
+            new_features ([QgsFeature]): features from updated db
+        """
+
+        listOfIds = [feat.id() for feat in layer.getFeatures()]
+        layer.deleteFeatures(listOfIds)
+
+        for feature_id, feature in enumerate(new_features):
+            feature.setAttribute(0, feature_id)
+            feature.setId(feature_id)
+
+        layer.addFeatures(new_features)
+
     def sync_now(self):
 
         # Load settings variables     
@@ -233,12 +463,15 @@ class Syncronizer:
         self._fetch()
         
         # Merge local db file if updated file is different or there are local changes
-        if not self._equal(self._filename, self._up_filename) or os.path.exists(self.changed_project_status_filepath) or os.path.exists(self.changed_project_status_filepath):
+        if not self._equal(self._filename, self._up_filename, self._digest_cache_filename) or self._status_journal.has_changes():
             
+            # counts of merged layers are summed up, and shown in one message
+            self._merge_counts = None
+
             layer_definition = self._layer_definitions
             for layer_name in layer_definition:
                 
-                self.signal_new_process_name(f"Oppdaterer lag {layer_name}... (kan ta et par minutter)")
+                self.signal_new_process_name(f"Oppdaterer lag {layer_name}...")
                 self.signal_progress(1)
 
                 # Add new features to layer
@@ -246,6 +479,10 @@ class Syncronizer:
      
                 self.signal_progress(100)
 
+            if self._merge_counts:
+                added_count, updated_count, deleted_count = self._merge_counts
+                self.signal_info_message(f"Synkronisert: {added_count} nye, {updated_count} endret, {deleted_count} slettet")
+
             utils.save_and_write_project()
                 
         self.worker.finished.emit(False)
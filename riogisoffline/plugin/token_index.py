@@ -0,0 +1,187 @@
+import heapq
+import re
+from collections import Counter
+
+from .prefix_index import PrefixIndex
+
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase words and numbers
+
+    Args:
+        text (str): text
+
+    Returns:
+        [str]: tokens
+    """
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+def trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TokenIndex:
+    """
+    Ranked search over documents with one or more text fields
+
+    Every token of a query is matched against the tokens of the documents, either
+    exactly, as a prefix, or (for words of three or more letters) by trigram
+    similarity, so misspelled words are found. Documents are ranked by the number
+    of query tokens they match, then by how well they match, and the k best are
+    found with a bounded heap.
+
+    Attributes:
+    min_similarity : float
+        minimum trigram similarity (0 to 1) of a misspelled token
+    max_expansions : int
+        max number of tokens a query token can match as a prefix
+    """
+
+    def __init__(self, documents=(), min_similarity=0.5, max_expansions=100):
+        """
+        Args:
+            documents ([([str], object)], optional): (text fields, value) pairs. Defaults to ().
+            min_similarity (float, optional): minimum trigram similarity of a misspelled token. Defaults to 0.5.
+            max_expansions (int, optional): max number of tokens matched by a prefix. Defaults to 100.
+        """
+        self.min_similarity = min_similarity
+        self.max_expansions = max_expansions
+
+        self._values = []
+        # token -> ids of documents containing token
+        self._postings = {}
+
+        for fields, value in documents:
+            self._add(fields, value)
+
+        self._tokens = PrefixIndex((token, token) for token in self._postings)
+
+        # trigram -> tokens containing trigram
+        self._trigram_tokens = {}
+        self._trigram_counts = {}
+
+        for token in self._postings:
+            self._add_trigrams(token)
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, fields, value):
+        """
+        Add document to index, e.g. a feature added after the index was built
+
+        Args:
+            fields ([str]): text fields
+            value (object): value returned when document matches
+        """
+        for token in self._add(fields, value):
+            self._tokens.add(token, token)
+            self._add_trigrams(token)
+
+    def _add(self, fields, value):
+        """
+        Add document to postings
+
+        Returns:
+            [str]: tokens that were not in the index before
+        """
+        doc = len(self._values)
+        self._values.append(value)
+
+        tokens = {token for field in fields if field for token in tokenize(field)}
+        new_tokens = [token for token in tokens if token not in self._postings]
+
+        for token in tokens:
+            self._postings.setdefault(token, []).append(doc)
+
+        return new_tokens
+
+    def _add_trigrams(self, token):
+        # query tokens like these are never matched by trigrams
+        if len(token) < 3 or token.isdigit():
+            return
+
+        token_trigrams = trigrams(token)
+        self._trigram_counts[token] = len(token_trigrams)
+
+        for trigram in token_trigrams:
+            self._trigram_tokens.setdefault(trigram, []).append(token)
+
+    def matching_tokens(self, query_token):
+        """
+        Get tokens matching a query token, with a score from 0 to 1
+
+        Args:
+            query_token (str): lowercase query token
+
+        Returns:
+            dict: token -> score
+        """
+        matches = {}
+
+        for token in self._tokens.search(query_token, self.max_expansions):
+            # completions close to the length of the query token rank higher
+            matches[token] = 1.0 if token == query_token else 0.5 + 0.4 * len(query_token) / len(token)
+
+        # ids are not misspelled in the same way as words, and numbers share most trigrams
+        if len(query_token) < 3 or query_token.isdigit():
+            return matches
+
+        query_trigrams = trigrams(query_token)
+        shared_trigrams = Counter(
+            token
+            for trigram in query_trigrams
+            for token in self._trigram_tokens.get(trigram, [])
+        )
+
+        for token, shared in shared_trigrams.items():
+            similarity = shared / (len(query_trigrams) + self._trigram_counts[token] - shared)
+
+            if similarity >= self.min_similarity:
+                matches[token] = max(matches.get(token, 0), 0.8 * similarity)
+
+        return matches
+
+    def search(self, query, k=10, accept=None):
+        """
+        Get the k documents best matching query
+
+        Args:
+            query (str): one or more words or numbers
+            k (int, optional): max number of values. Defaults to 10.
+            accept (function, optional): function(value) returning False for values to skip. Defaults to None.
+
+        Returns:
+            [object]: values of documents, best match first
+        """
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+
+        # doc -> [number of matched query tokens, total score]
+        matched_docs = {}
+
+        for query_token in query_tokens:
+            best_scores = {}
+
+            for token, score in self.matching_tokens(query_token).items():
+                for doc in self._postings[token]:
+                    if score > best_scores.get(doc, 0):
+                        best_scores[doc] = score
+
+            for doc, score in best_scores.items():
+                matched = matched_docs.setdefault(doc, [0, 0.0])
+                matched[0] += 1
+                matched[1] += score
+
+        # earlier documents win ties
+        candidates = (
+            (count, score, -doc)
+            for doc, (count, score) in matched_docs.items()
+            if accept is None or accept(self._values[doc])
+        )
+
+        return [self._values[-doc] for _, _, doc in heapq.nlargest(k, candidates)]
@@ -6,6 +6,7 @@ from qgis.PyQt import uic, QtWidgets
 from qgis.PyQt.QtCore import Qt
 
 from .multi_thread_job import MultiThreadJob
+from .status_journal import StatusJournal
 
 import riogisoffline.plugin.utils as utils
 
@@ -89,15 +90,10 @@ class UploadDialog(QtWidgets.QDialog, FORM_CLASS):
     
     def _show_if_changed_statuses(self):
         # show status change uploads
-        user_settings = utils.get_user_settings_path()
-        user_settings = utils.load_json(user_settings)
-        file_folder_path = user_settings["file_folder"]
+        journal = utils.get_status_journal(self.riogis.settings["file_folder"], self.riogis.settings)
 
-        changed_status_filename = os.path.join(file_folder_path, self.riogis.settings["changed_status_filename"])
-        self.has_changed_status = os.path.exists(changed_status_filename)
-
-        changed_project_status_filename = os.path.join(file_folder_path, self.riogis.settings["changed_project_status_filename"])
-        self.has_changed_project_status = os.path.exists(changed_project_status_filename)
+        self.has_changed_status = journal.has_changes(StatusJournal.ORDER_STATUS)
+        self.has_changed_project_status = journal.has_changes(StatusJournal.PROJECT_STATUS)
         
 
     def _item_clicked(self, item):
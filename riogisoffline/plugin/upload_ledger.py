@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+
+
+class UploadLedger:
+    """
+    Record of files that are uploaded, saved as a json-file so that it persists
+    between QGIS sessions. Each file is recorded with size, modification time,
+    MD5 and the blob it was uploaded to.
+
+    Files that are partly uploaded have a checkpoint, so that an interrupted
+    upload can be continued. The staged blocks are listed from the blob when
+    the upload is continued, so they are not recorded.
+
+    Attributes:
+    path : str
+        path to json-file
+    """
+
+    def __init__(self, path, save_interval=5):
+        self.path = path
+        self.save_interval = save_interval
+
+        self._lock = threading.Lock()
+        self._last_save_time = time.monotonic()
+        self._files = {}
+        self._checkpoints = {}
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self._files = data.get("files", {})
+                self._checkpoints = data.get("checkpoints", {})
+            except (OSError, ValueError, AttributeError):
+                self._files = {}
+                self._checkpoints = {}
+
+    @staticmethod
+    def _key(filename):
+        return os.path.abspath(filename)
+
+    @staticmethod
+    def _is_unchanged(entry, filename, blob_name):
+        if not entry or entry.get("blob") != blob_name:
+            return False
+
+        stat = os.stat(filename)
+
+        return entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime
+
+    def content_md5(self, filename, blob_name):
+        """
+        Get MD5 of file recorded when it was uploaded, if file is unchanged since then
+
+        Args:
+            filename (str): path to local file
+            blob_name (str): name of blob file should be uploaded to
+
+        Returns:
+            str: base64 encoded MD5, or None if file is not uploaded to blob or has changed
+        """
+        with self._lock:
+            entry = self._files.get(self._key(filename))
+
+        if not self._is_unchanged(entry, filename, blob_name):
+            return None
+
+        return entry.get("md5")
+
+    def has_checkpoint(self, filename, blob_name):
+        """
+        Check if an earlier upload of the unchanged file to blob was interrupted
+
+        Args:
+            filename (str): path to local file
+            blob_name (str): name of blob file should be uploaded to
+
+        Returns:
+            bool: True if there are staged blocks that may be reused
+        """
+        with self._lock:
+            checkpoint = self._checkpoints.get(self._key(filename))
+
+        return self._is_unchanged(checkpoint, filename, blob_name)
+
+    def record_checkpoint(self, filename, blob_name):
+        """
+        Record that blocks of file are staged. Ledger is saved if it is more than save_interval seconds since last save
+
+        Args:
+            filename (str): path to local file
+            blob_name (str): name of blob file is uploaded to
+        """
+        key = self._key(filename)
+
+        with self._lock:
+            checkpoint = self._checkpoints.get(key)
+
+            if not checkpoint or checkpoint.get("blob") != blob_name:
+                stat = os.stat(filename)
+                self._checkpoints[key] = {
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "blob": blob_name,
+                }
+
+        self._save_if_due()
+
+    def record(self, filename, blob_name, content_md5):
+        """
+        Record that file is uploaded, and remove its checkpoint. Ledger is saved if it is more than save_interval seconds since last save
+
+        Args:
+            filename (str): path to local file
+            blob_name (str): name of blob file is uploaded to
+            content_md5 (str): base64 encoded MD5 of file
+        """
+        stat = os.stat(filename)
+        key = self._key(filename)
+
+        with self._lock:
+            self._files[key] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "md5": content_md5,
+                "blob": blob_name,
+            }
+            self._checkpoints.pop(key, None)
+
+        self._save_if_due()
+
+    def _save_if_due(self):
+        with self._lock:
+            should_save = time.monotonic() - self._last_save_time > self.save_interval
+
+        if should_save:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            temp_path = self.path + ".tmp"
+
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"files": self._files, "checkpoints": self._checkpoints}, f, ensure_ascii=False)
+
+            os.replace(temp_path, self.path)
+            self._last_save_time = time.monotonic()
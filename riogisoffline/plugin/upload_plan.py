@@ -0,0 +1,170 @@
+import os
+import threading
+import time
+
+
+class PlannedFile:
+    """
+    File in a project that is selected for upload
+
+    Attributes:
+    project : str
+        name of project dir
+    subdir : str
+        name of subdir group ("DB", "Document", "Image" or "Video")
+    file_path : str
+        path to local file
+    blob_client : BlobClient
+        client of blob to upload to
+    is_uploaded : bool
+        True if file is already uploaded, and will be skipped
+    """
+
+    def __init__(self, project, subdir, file_path, blob_client, is_uploaded):
+        self.project = project
+        self.subdir = subdir
+        self.file_path = file_path
+        self.blob_client = blob_client
+        self.is_uploaded = is_uploaded
+        self.size = os.path.getsize(file_path)
+
+    def display_name(self):
+        return f"{self.project}/{self.subdir}/{os.path.basename(self.file_path)}"
+
+
+class UploadPlan:
+    """
+    Files in the selected projects, found by walking the projects once before upload starts
+    """
+
+    def __init__(self):
+        self.files = []
+
+    def add(self, planned_file):
+        self.files.append(planned_file)
+
+    def files_to_upload(self):
+        return [planned_file for planned_file in self.files if not planned_file.is_uploaded]
+
+    def uploaded_files(self):
+        return [planned_file for planned_file in self.files if planned_file.is_uploaded]
+
+    def total_bytes(self):
+        return sum(planned_file.size for planned_file in self.files_to_upload())
+
+    def bytes_per_subdir(self):
+        """
+        Get number of bytes to upload from each subdir group
+
+        Returns:
+            dict: subdir -> bytes
+        """
+        bytes_per_subdir = {}
+
+        for planned_file in self.files_to_upload():
+            bytes_per_subdir[planned_file.subdir] = bytes_per_subdir.get(planned_file.subdir, 0) + planned_file.size
+
+        return bytes_per_subdir
+
+    def summary(self):
+        subdir_texts = [f"{subdir}: {format_bytes(size)}" for subdir, size in self.bytes_per_subdir().items()]
+
+        text = f"Skal laste opp {len(self.files_to_upload())} filer, {format_bytes(self.total_bytes())}"
+
+        if subdir_texts:
+            text += f" ({', '.join(subdir_texts)})"
+
+        if self.uploaded_files():
+            text += f". {len(self.uploaded_files())} filer er allerede lastet opp"
+
+        return text
+
+
+class UploadProgress:
+    """
+    Total progress of an upload, with estimated time left from measured throughput
+
+    Attributes:
+    total_bytes : int
+        number of bytes to upload
+    file_count : int
+        number of files to upload
+    resumed_bytes : int
+        number of bytes staged by an earlier, interrupted upload. Not used to measure throughput
+    """
+
+    def __init__(self, total_bytes, file_count):
+        self.total_bytes = total_bytes
+        self.file_count = file_count
+        self.resumed_bytes = 0
+
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._uploaded_bytes = 0
+        self._uploaded_files = 0
+
+    def update(self, uploaded_bytes):
+        with self._lock:
+            self._uploaded_bytes = uploaded_bytes
+
+    def add_resumed_bytes(self, resumed_bytes):
+        with self._lock:
+            self.resumed_bytes += resumed_bytes
+
+    def file_done(self):
+        with self._lock:
+            self._uploaded_files += 1
+
+    def percent(self):
+        if not self.total_bytes:
+            return 100
+
+        return min(int(self._uploaded_bytes / self.total_bytes * 100), 100)
+
+    def seconds_left(self):
+        """
+        Estimate time left from throughput since upload started. Resumed bytes are
+        reported as uploaded at once, so they are not counted as sent
+
+        Returns:
+            float: seconds left, or None if nothing is sent yet
+        """
+        elapsed = time.monotonic() - self._start_time
+        sent_bytes = self._uploaded_bytes - self.resumed_bytes
+
+        if sent_bytes <= 0 or not elapsed:
+            return None
+
+        bytes_per_second = sent_bytes / elapsed
+
+        return (self.total_bytes - self._uploaded_bytes) / bytes_per_second
+
+    def text(self):
+        text = f"Laster opp: {self._uploaded_files} av {self.file_count} filer, {format_bytes(self._uploaded_bytes)} av {format_bytes(self.total_bytes)}"
+
+        seconds_left = self.seconds_left()
+
+        if seconds_left is not None:
+            text += f", ca. {format_duration(seconds_left)} igjen"
+
+        return text
+
+
+def format_bytes(size):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} GB"
+
+def format_duration(seconds):
+    if seconds < 60:
+        return "under ett minutt"
+
+    minutes = int(seconds // 60)
+
+    if minutes < 60:
+        return f"{minutes} min"
+
+    return f"{minutes // 60} t {minutes % 60} min"
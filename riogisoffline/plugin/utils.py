@@ -1,13 +1,14 @@
 import os
 import json
+import configparser
 import requests
-import csv
-import pandas as pd
 
 from qgis.utils import iface
 from qgis.core import Qgis, QgsProject
 from qgis.PyQt import QtGui, QtWidgets, QtCore
 
+from .status_journal import StatusJournal
+
 default_message_duration = 3
 
 def get_plugin_dir(path_to_join=None):
@@ -91,12 +92,54 @@ def get_user_settings_path():
     # bruker_settings.json is placed in python-dir of qgis default profile
     return get_plugin_dir("../../../bruker_settings.json")
 
+def get_upload_ledger_path():
+    # upload ledger is placed next to bruker_settings.json
+    return get_plugin_dir("../../../riogis_upload_ledger.json")
+
+def get_style_cache_dir():
+    # map styles are cached next to bruker_settings.json
+    return get_plugin_dir("../../../riogis_style_cache")
+
+def get_plugin_version():
+    """
+    Get version of plugin from metadata.txt
+
+    Returns:
+        str: version, or None if metadata.txt can not be read
+    """
+    metadata = configparser.ConfigParser()
+    metadata.read(get_plugin_dir("metadata.txt"), encoding="utf-8")
+
+    return metadata.get("general", "version", fallback=None)
+
 def get_settings_path():
     return get_plugin_dir("settings.json")
 
 def get_db_name():
     return "oslo_offline.db"
 
+def get_sync_manifest_path(file_folder):
+    return os.path.join(file_folder, "sync_manifest.json")
+
+def get_status_journal(file_folder, settings):
+    """
+    Get journal of status changes made offline. Changes in csv-files written by
+    earlier versions are moved into the journal
+
+    Args:
+        file_folder (str): path to folder with synced files
+        settings (dict): settings
+
+    Returns:
+        StatusJournal: journal
+    """
+    journal = StatusJournal(os.path.join(file_folder, settings["status_journal_filename"]))
+
+    journal.import_csv(os.path.join(file_folder, settings["changed_status_filename"]), StatusJournal.ORDER_STATUS)
+    journal.import_csv(os.path.join(file_folder, settings["changed_project_status_filename"]), StatusJournal.PROJECT_STATUS)
+
+    return journal
+
 def set_busy_cursor(set_busy=True):
     """Set cursor to BusyCursor (or back to ArrowCursor)
 
@@ -165,28 +208,16 @@ def synced_files_exist():
 
 def write_changed_status_to_file(settings, lsid, new_status, comment, project_area_id):
         try:
-            user_settings = get_user_settings_path()
-            # read user settings
-            user_settings = load_json(user_settings)
-            file_folder_path = user_settings["file_folder"]
-            
-            changed_status_filename = os.path.join(file_folder_path, settings["changed_status_filename"])
+            journal = get_status_journal(settings["file_folder"], settings)
 
             status_change_dict = {
-                "lsid": [lsid],
-                "new_status": [new_status],
-                "comment": [comment],
-                "project_area_id": [project_area_id]
+                "lsid": lsid,
+                "new_status": new_status,
+                "comment": comment,
+                "project_area_id": project_area_id
             }
 
-            status_df = pd.DataFrame.from_dict(status_change_dict)
-
-            # don't write header if file exists
-            if os.path.exists(changed_status_filename):
-                status_df.to_csv(changed_status_filename, mode="a", header=False, index=False) 
-            else:
-                field_headers = status_change_dict.keys()
-                status_df.to_csv(changed_status_filename, mode="a", header=field_headers, index=False) 
+            journal.write(StatusJournal.ORDER_STATUS, status_change_dict)
 
         except Exception as e:
             printWarningMessage(str(e))
@@ -213,27 +244,15 @@ def change_project_status(settings, layer, project_feature, new_status, comment)
 
 def write_changed_project_status_to_file(settings, project_area_id, new_status, comment):
         try:
-            user_settings = get_user_settings_path()
-            # read user settings
-            user_settings = load_json(user_settings)
-            file_folder_path = user_settings["file_folder"]
-            
-            changed_project_status_filename = os.path.join(file_folder_path, settings["changed_project_status_filename"])
+            journal = get_status_journal(settings["file_folder"], settings)
 
             status_change_dict = {
-                "GlobalID": [project_area_id],
-                "new_status": [new_status],
-                "comments_inspector": [comment]
+                "GlobalID": project_area_id,
+                "new_status": new_status,
+                "comments_inspector": comment
             }
 
-            status_df = pd.DataFrame.from_dict(status_change_dict)
-
-            # don't write header if file exists
-            if os.path.exists(changed_project_status_filename):
-                status_df.to_csv(changed_project_status_filename, mode="a", header=False, index=False) 
-            else:
-                field_headers = status_change_dict.keys()
-                status_df.to_csv(changed_project_status_filename, mode="a", header=field_headers, index=False) 
+            journal.write(StatusJournal.PROJECT_STATUS, status_change_dict)
 
         except Exception as e:
             printWarningMessage(str(e))
@@ -0,0 +1,104 @@
+import base64
+import hashlib
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from riogisoffline.plugin.block_upload import BlockUpload, BlockUploadPipeline
+
+
+class FakeBlobClient:
+    def __init__(self):
+        self.staged = {}
+        self.committed = None
+
+    def stage_block(self, block_id, data):
+        self.staged[block_id] = data
+
+    def get_block_list(self, block_list_type):
+        uncommitted = [SimpleNamespace(id=block_id, size=len(data)) for block_id, data in self.staged.items()]
+        return [], uncommitted
+
+    def commit_block_list(self, block_list, content_settings=None):
+        self.committed = b"".join(self.staged[block.id] for block in block_list)
+
+
+@pytest.fixture
+def files(tmp_path):
+    contents = [os.urandom(10_000), os.urandom(3_000), b""]
+    filenames = []
+
+    for i, content in enumerate(contents):
+        filename = tmp_path / f"file{i}"
+        filename.write_bytes(content)
+        filenames.append(str(filename))
+
+    return filenames, contents
+
+def test_block_ids_are_deterministic(files):
+    filenames, _ = files
+
+    upload1 = BlockUpload(FakeBlobClient(), filenames[0], block_size=1024)
+    upload2 = BlockUpload(FakeBlobClient(), filenames[0], block_size=1024)
+
+    assert upload1.block_id(3) == upload2.block_id(3)
+    assert len(set(len(upload1.block_id(i)) for i in range(upload1.block_count()))) == 1
+
+def test_pipeline_uploads_all_files(files):
+    filenames, contents = files
+    progress = []
+    done = []
+
+    pipeline = BlockUploadPipeline(max_workers=3, max_in_flight_bytes=4096, progress_callback=lambda staged, total: progress.append(staged / total))
+
+    clients = [FakeBlobClient() for _ in filenames]
+    for client, filename in zip(clients, filenames):
+        pipeline.add(BlockUpload(client, filename, block_size=1024), done.append)
+
+    pipeline.run()
+
+    assert [client.committed for client in clients] == contents
+    # uploads are committed concurrently, so they may be done in any order
+    assert {upload.filename: upload.content_md5() for upload in done} == {
+        filename: base64.b64encode(hashlib.md5(content).digest()).decode()
+        for filename, content in zip(filenames, contents)
+    }
+    assert len(done) == len(filenames)
+    assert progress[-1] == 1
+
+def test_pipeline_raises_when_staging_fails(files):
+    filenames, _ = files
+
+    class FailingBlobClient(FakeBlobClient):
+        def stage_block(self, block_id, data):
+            raise IOError("upload failed")
+
+    client = FailingBlobClient()
+    pipeline = BlockUploadPipeline()
+    pipeline.add(BlockUpload(client, filenames[0], block_size=1024))
+
+    with pytest.raises(IOError):
+        pipeline.run()
+    assert client.committed is None
+
+def test_resumed_upload_only_stages_missing_blocks(files):
+    filenames, contents = files
+    client = FakeBlobClient()
+
+    interrupted_upload = BlockUpload(client, filenames[0], block_size=1024)
+    for index, data in interrupted_upload.read_blocks():
+        if index == 5:
+            break
+        interrupted_upload.stage(index, data)
+
+    staged_blocks = []
+    upload = BlockUpload(client, filenames[0], block_size=1024)
+    upload.resume()
+
+    pipeline = BlockUploadPipeline()
+    pipeline.add(upload, on_block_staged=lambda upload, index: staged_blocks.append(index))
+    pipeline.run()
+
+    assert sorted(staged_blocks) == list(range(5, upload.block_count()))
+    assert client.committed == contents[0]
@@ -0,0 +1,22 @@
+from riogisoffline.plugin.prefix_index import PrefixIndex
+
+
+def test_search_is_case_insensitive_and_sorted():
+    index = PrefixIndex([("Tokerudberget", 1), ("10234", 2), ("tokerud", 3), ("1023", 4), ("Toftes gate", 5)])
+
+    assert index.search("TOKE") == [3, 1]
+    assert index.search("1023") == [4, 2]
+    assert index.search("x") == []
+
+def test_search_limit():
+    index = PrefixIndex((str(lsid), lsid) for lsid in range(1000, 1100))
+
+    assert index.search("10", limit=5) == [1000, 1001, 1002, 1003, 1004]
+    assert len(index.search("10")) == 100
+
+def test_add_keeps_keys_sorted():
+    index = PrefixIndex([("1023", 1), ("1025", 2)])
+    index.add("1024", 3)
+    index.add("1023", 4)
+
+    assert index.search("102") == [1, 4, 3, 2]
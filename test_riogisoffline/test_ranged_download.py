@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from riogisoffline.plugin.ranged_download import RangedDownload
+
+
+@pytest.fixture
+def content():
+    return os.urandom(100_003)
+
+def test_ranges_cover_file(tmp_path):
+    download = RangedDownload(None, 10, str(tmp_path / "file"), range_size=4)
+    assert download.ranges() == [(0, 3), (4, 7), (8, 9)]
+
+def test_run_writes_file(tmp_path, content):
+    filename = str(tmp_path / "file")
+    progress = []
+
+    download = RangedDownload(
+        lambda start, end: content[start:end + 1],
+        len(content),
+        filename,
+        progress.append,
+        range_size=4096,
+    )
+    download.run()
+
+    with open(filename, "rb") as f:
+        assert f.read() == content
+    assert not os.path.exists(filename + ".part")
+    assert progress[-1] == 100
+
+def test_run_fails_on_short_range(tmp_path, content):
+    filename = str(tmp_path / "file")
+
+    download = RangedDownload(lambda start, end: content[start:end], len(content), filename, range_size=4096)
+
+    with pytest.raises(IOError):
+        download.run()
+    assert not os.path.exists(filename)
+
+def test_run_resumes_partial_download(tmp_path, content):
+    filename = str(tmp_path / "file")
+    fetched = []
+
+    def failing_fetch(start, end):
+        if start >= 8192:
+            raise IOError("connection lost")
+        return content[start:end + 1]
+
+    download = RangedDownload(failing_fetch, len(content), filename, range_size=4096, max_workers=1, validator="etag")
+    with pytest.raises(IOError):
+        download.run()
+    assert os.path.exists(filename + ".part.json")
+
+    def fetch(start, end):
+        fetched.append(start)
+        return content[start:end + 1]
+
+    download = RangedDownload(fetch, len(content), filename, range_size=4096, validator="etag")
+    download.run()
+
+    assert 0 not in fetched and 4096 not in fetched
+    with open(filename, "rb") as f:
+        assert f.read() == content
+    assert not os.path.exists(filename + ".part.json")
+
+def test_run_fails_on_wrong_checksum(tmp_path, content):
+    filename = str(tmp_path / "file")
+
+    download = RangedDownload(lambda start, end: content[start:end + 1], len(content), filename, range_size=4096, expected_md5=b"0" * 16)
+
+    with pytest.raises(IOError):
+        download.run()
+    assert not os.path.exists(filename)
+    assert not os.path.exists(filename + ".part")
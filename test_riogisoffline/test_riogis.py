@@ -3,6 +3,7 @@ from pyvirtualdisplay import Display
 
 import os
 import sys
+import time
 import pytest
 
 from qgis.testing.mocked import get_iface
@@ -10,7 +11,7 @@ sys.path = [os.path.abspath('..')]+sys.path
 from riogisoffline.plugin.riogis import RioGIS
 from riogisoffline.plugin.utils import get_plugin_dir
 from mock_extension import Layer, Point
-from qgis.core import QgsPointXY
+from qgis.core import QgsApplication, QgsFeature, QgsGeometry, QgsPointXY, QgsProject, QgsVectorLayer
 
 FEATURE_LAYER_NAME = "Bestillinger"
 
@@ -113,6 +114,53 @@ def test_update_feature_status(riogis):
     riogis.map_attributes()
     riogis.update_feature_status()
 
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+
+    while not condition() and time.monotonic() < deadline:
+        QgsApplication.processEvents()
+
+    return condition()
+
+def _search(search_box, text):
+    search_box.dlg.searchResults.clear()
+    search_box._text = text
+    search_box.search()
+
+def test_search_result_cache_is_cleared_when_index_is_rebuilt(riogis):
+    search_box = riogis.search_box
+    results = search_box.dlg.searchResults
+
+    layer = QgsVectorLayer("Point?crs=EPSG:25832&field=lsid:string", "Bestillinger", "memory")
+    feature = QgsFeature(layer.fields())
+    feature["lsid"] = "1234"
+    feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(10, 20)))
+    layer.dataProvider().addFeature(feature)
+
+    QgsProject.instance().addMapLayer(layer)
+    canvas = riogis.iface.mapCanvas()
+    canvas.setLayers([layer])
+
+    _search(search_box, "12")
+    assert _wait_for(lambda: results.count() == 1)
+
+    # cached result is shown and zoomed to without reading the layer
+    layer.dataProvider().deleteFeatures([feature.id()])
+
+    _search(search_box, "12")
+    assert results.count() == 1
+
+    search_box.onItemClicked(results.item(0))
+    assert canvas.extent().contains(QgsPointXY(10, 20))
+
+    # rebuilt index reads the layer again, so the deleted feature is not found
+    search_box.build_index()
+
+    _search(search_box, "12")
+    assert not _wait_for(lambda: results.count() > 0, timeout=2)
+
+    QgsProject.instance().removeMapLayer(layer)
+
 def test_refresh_map(riogis):
     riogis.refresh_map()
 
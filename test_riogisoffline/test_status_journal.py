@@ -0,0 +1,54 @@
+from riogisoffline.plugin.status_journal import StatusJournal
+
+
+def _order_change(lsid, new_status, project_area_id="P1"):
+    return {"lsid": lsid, "new_status": new_status, "comment": "", "project_area_id": project_area_id}
+
+def test_last_change_of_order_is_kept(tmp_path):
+    journal = StatusJournal(str(tmp_path / "status_journal.db"))
+    assert not journal.has_changes()
+
+    journal.write(StatusJournal.ORDER_STATUS, _order_change(1234, 1))
+    journal.write(StatusJournal.ORDER_STATUS, _order_change(5678, 2))
+    journal.write(StatusJournal.ORDER_STATUS, _order_change(1234, 4))
+    journal.write(StatusJournal.ORDER_STATUS, _order_change(1234, 2, project_area_id="P2"))
+
+    changes = [change for _, change in journal.changes(StatusJournal.ORDER_STATUS)]
+
+    assert changes == [_order_change(5678, 2), _order_change(1234, 4), _order_change(1234, 2, project_area_id="P2")]
+    assert journal.has_changes()
+    assert not journal.has_changes(StatusJournal.PROJECT_STATUS)
+
+def test_remove_keeps_later_changes(tmp_path):
+    journal = StatusJournal(str(tmp_path / "status_journal.db"))
+
+    journal.write(StatusJournal.ORDER_STATUS, _order_change(1234, 1))
+    uploaded_seq = journal.changes(StatusJournal.ORDER_STATUS)[-1][0]
+    journal.write(StatusJournal.ORDER_STATUS, _order_change(5678, 2))
+
+    journal.remove(StatusJournal.ORDER_STATUS, uploaded_seq)
+
+    assert [change for _, change in journal.changes(StatusJournal.ORDER_STATUS)] == [_order_change(5678, 2)]
+    assert journal.changes(StatusJournal.ORDER_STATUS, after_seq=uploaded_seq + 1) == []
+
+def test_import_csv(tmp_path):
+    csv_path = tmp_path / "changed_project_status.csv"
+    csv_path.write_text("GlobalID,new_status,comments_inspector\n{A},2,\n{B},3,ok\n{A},4,ferdig\n", encoding="utf-8")
+
+    journal = StatusJournal(str(tmp_path / "status_journal.db"))
+    journal.import_csv(str(csv_path), StatusJournal.PROJECT_STATUS)
+
+    assert not csv_path.exists()
+    assert [change for _, change in journal.changes(StatusJournal.PROJECT_STATUS)] == [
+        {"GlobalID": "{B}", "new_status": 3, "comments_inspector": "ok"},
+        {"GlobalID": "{A}", "new_status": 4, "comments_inspector": "ferdig"},
+    ]
+
+def test_write_to_file_without_tables(tmp_path):
+    path = tmp_path / "status_journal.db"
+    path.touch()
+
+    journal = StatusJournal(str(path))
+    journal.write(StatusJournal.ORDER_STATUS, _order_change(1234, 1))
+
+    assert [change for _, change in journal.changes(StatusJournal.ORDER_STATUS)] == [_order_change(1234, 1)]
@@ -0,0 +1,125 @@
+import pytest
+
+from qgis.core import QgsFeature, QgsGeometry, QgsPointXY, QgsVectorLayer
+from qgis.testing import start_app
+
+from riogisoffline.plugin.status_journal import StatusJournal
+from riogisoffline.plugin.syncronizer import Syncronizer
+
+FIELDS = "field=fid:integer&field=lsid:string&field=project_area_id:string&field=status_internal:integer"
+KEY_FIELDS = ["lsid", "project_area_id"]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def qgis_app():
+    start_app()
+
+
+@pytest.fixture
+def syncronizer():
+    # skip __init__, it reads the plugin settings
+    return Syncronizer.__new__(Syncronizer)
+
+
+def _layer(rows, fields=FIELDS, project_area_id="P1"):
+    layer = QgsVectorLayer(f"Point?crs=EPSG:25832&{fields}", "Bestillinger", "memory")
+    features = []
+
+    for fid, lsid, status, x in rows:
+        feature = QgsFeature(layer.fields())
+        feature["fid"] = fid
+        feature["lsid"] = lsid
+        feature["project_area_id"] = project_area_id
+        feature["status_internal"] = status
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, 0)))
+        features.append(feature)
+
+    layer.dataProvider().addFeatures(features)
+
+    return layer
+
+
+def _merge(syncronizer, layer, new_layer):
+    layer.startEditing()
+    merge_counts = syncronizer._merge_features(layer, list(new_layer.getFeatures()), KEY_FIELDS)
+    edit_buffer = layer.editBuffer()
+    changed_ids = set(edit_buffer.changedAttributeValues()) | set(edit_buffer.changedGeometries())
+    assert layer.commitChanges()
+
+    return merge_counts, changed_ids
+
+
+def _rows(layer):
+    return {
+        feature["lsid"]: (feature.id(), feature["status_internal"], feature.geometry().asPoint().x())
+        for feature in layer.getFeatures()
+    }
+
+
+def test_merge_updates_changed_feature_in_place(syncronizer):
+    layer = _layer([(1, "A", 1, 10), (2, "B", 1, 20)])
+    old_rows = _rows(layer)
+
+    merge_counts, changed_ids = _merge(syncronizer, layer, _layer([(7, "A", 2, 10), (8, "B", 1, 25)]))
+    rows = _rows(layer)
+
+    assert rows["A"] == (old_rows["A"][0], 2, 10)
+    assert rows["B"] == (old_rows["B"][0], 1, 25)
+    assert changed_ids == {old_rows["A"][0], old_rows["B"][0]}
+    assert merge_counts == (0, 2, 0)
+
+def test_merge_adds_new_feature(syncronizer):
+    layer = _layer([(1, "A", 1, 10)])
+
+    merge_counts, _ = _merge(syncronizer, layer, _layer([(1, "A", 1, 10), (2, "C", 3, 30)]))
+    rows = _rows(layer)
+
+    assert set(rows) == {"A", "C"}
+    assert rows["C"][1:] == (3, 30)
+    assert merge_counts == (1, 0, 0)
+
+def test_merge_deletes_removed_feature(syncronizer):
+    layer = _layer([(1, "A", 1, 10), (2, "B", 1, 20)])
+
+    merge_counts, _ = _merge(syncronizer, layer, _layer([(1, "A", 1, 10)]))
+
+    assert set(_rows(layer)) == {"A"}
+    assert merge_counts == (0, 0, 1)
+
+def test_merge_leaves_unchanged_feature_alone(syncronizer):
+    layer = _layer([(1, "A", 1, 10), (2, "B", 1, 20)])
+    old_rows = _rows(layer)
+
+    # fid differs in the updated db, but is not compared
+    merge_counts, changed_ids = _merge(syncronizer, layer, _layer([(5, "A", 1, 10), (6, "B", 1, 20)]))
+
+    assert _rows(layer) == old_rows
+    assert not changed_ids
+    assert merge_counts == (0, 0, 0)
+
+def test_missing_key_or_different_fields_are_replaced(syncronizer):
+    layer = _layer([(1, "A", 1, 10)])
+    new_layer = _layer([(1, "B", 2, 20)])
+    other_fields_layer = _layer([(1, "B", 2, 20)], fields=f"{FIELDS}&field=comment:string")
+
+    assert Syncronizer._has_same_fields(layer, new_layer, KEY_FIELDS)
+    assert not Syncronizer._has_same_fields(layer, new_layer, ["lsid", "GlobalID"])
+    assert not Syncronizer._has_same_fields(layer, other_fields_layer, KEY_FIELDS)
+
+    layer.startEditing()
+    Syncronizer._replace_features(layer, list(new_layer.getFeatures()))
+    assert layer.commitChanges()
+
+    assert {lsid: row[1:] for lsid, row in _rows(layer).items()} == {"B": (2, 20)}
+
+def test_offline_status_of_order_without_project_is_kept(syncronizer, tmp_path):
+    syncronizer._status_journal = StatusJournal(str(tmp_path / "status_journal.db"))
+    syncronizer._status_journal.write(
+        StatusJournal.ORDER_STATUS,
+        {"lsid": "A", "new_status": 4, "comment": "", "project_area_id": None},
+    )
+    features = list(_layer([(1, "A", 1, 10), (2, "B", 1, 20)], project_area_id=None).getFeatures())
+
+    syncronizer._apply_local_status_changes("Bestillinger", features)
+
+    assert {feature["lsid"]: feature["status_internal"] for feature in features} == {"A": 4, "B": 1}
@@ -0,0 +1,43 @@
+from riogisoffline.plugin.token_index import TokenIndex, tokenize
+
+
+PIPES = [
+    (["1234", "Kirkeveien", "AF"], "kirkeveien-af"),
+    (["1234", "Kirkeveien", "VL"], "kirkeveien-vl"),
+    (["5678", "Kirkegata", "AF"], "kirkegata-af"),
+    (["12345", "Ullevålsveien", "SP"], "ullevaalsveien-sp"),
+]
+
+
+def test_tokenize():
+    assert tokenize("Kirkeveien 12-B") == ["kirkeveien", "12", "b"]
+
+def test_multi_token_query_ranks_documents_matching_all_tokens_first():
+    index = TokenIndex(PIPES)
+
+    assert index.search("Kirkeveien AF 1234", k=2) == ["kirkeveien-af", "kirkeveien-vl"]
+
+def test_exact_match_ranks_before_prefix_match():
+    index = TokenIndex(PIPES)
+
+    assert index.search("1234") == ["kirkeveien-af", "kirkeveien-vl", "ullevaalsveien-sp"]
+
+def test_misspelled_word_is_found():
+    index = TokenIndex(PIPES)
+
+    assert index.search("kirkevein", k=1) in [["kirkeveien-af"], ["kirkeveien-vl"]]
+    assert "ullevaalsveien-sp" in index.search("ulevålsveien")
+
+def test_accept_filters_values():
+    index = TokenIndex(PIPES)
+
+    assert index.search("kirke", accept=lambda value: value.endswith("af")) == ["kirkegata-af", "kirkeveien-af"]
+
+def test_added_document_is_found():
+    index = TokenIndex(PIPES)
+    index.add(["9999", "Kirkeveien", "OV"], "kirkeveien-ov")
+
+    assert len(index) == 5
+    assert index.search("9999") == ["kirkeveien-ov"]
+    assert "kirkeveien-ov" in index.search("kirkeveien ov", k=1)
+    assert "kirkeveien-ov" in index.search("kirkevein ov", k=1)
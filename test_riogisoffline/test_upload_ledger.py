@@ -0,0 +1,39 @@
+from riogisoffline.plugin.upload_ledger import UploadLedger
+
+
+def test_record_persists_between_sessions(tmp_path):
+    filename = tmp_path / "video.mpg"
+    filename.write_bytes(b"video")
+    ledger_path = str(tmp_path / "ledger.json")
+
+    ledger = UploadLedger(ledger_path)
+    ledger.record(str(filename), "tt/Video/video.mpg", "md5")
+    ledger.save()
+
+    ledger = UploadLedger(ledger_path)
+    assert ledger.content_md5(str(filename), "tt/Video/video.mpg") == "md5"
+    assert ledger.content_md5(str(filename), "tt/Video/other.mpg") is None
+
+def test_changed_file_is_not_uploaded(tmp_path):
+    filename = tmp_path / "video.mpg"
+    filename.write_bytes(b"video")
+
+    ledger = UploadLedger(str(tmp_path / "ledger.json"))
+    ledger.record(str(filename), "tt/Video/video.mpg", "md5")
+
+    filename.write_bytes(b"new video")
+    assert ledger.content_md5(str(filename), "tt/Video/video.mpg") is None
+
+def test_checkpoint_is_removed_when_file_is_uploaded(tmp_path):
+    filename = tmp_path / "video.mpg"
+    filename.write_bytes(b"video")
+
+    ledger = UploadLedger(str(tmp_path / "ledger.json"))
+    ledger.record_checkpoint(str(filename), "tt/Video/video.mpg")
+    ledger.record_checkpoint(str(filename), "tt/Video/video.mpg")
+
+    assert ledger.has_checkpoint(str(filename), "tt/Video/video.mpg")
+    assert not ledger.has_checkpoint(str(filename), "tt/Video/other.mpg")
+
+    ledger.record(str(filename), "tt/Video/video.mpg", "md5")
+    assert not ledger.has_checkpoint(str(filename), "tt/Video/video.mpg")
@@ -0,0 +1,44 @@
+from riogisoffline.plugin.upload_plan import PlannedFile, UploadPlan, UploadProgress, format_bytes
+
+
+def test_plan_counts_only_files_to_upload(tmp_path):
+    db = tmp_path / "project.db3"
+    db.write_bytes(b"x" * 2048)
+    video = tmp_path / "video.mpg"
+    video.write_bytes(b"x" * 1024)
+
+    plan = UploadPlan()
+    plan.add(PlannedFile("Prosjekt", "DB", str(db), None, False))
+    plan.add(PlannedFile("Prosjekt", "Video", str(video), None, True))
+
+    assert plan.total_bytes() == 2048
+    assert plan.bytes_per_subdir() == {"DB": 2048}
+    assert plan.summary() == "Skal laste opp 1 filer, 2 KB (DB: 2 KB). 1 filer er allerede lastet opp"
+
+def test_progress_percent_and_text():
+    progress = UploadProgress(4 * 1024 * 1024, 2)
+    assert progress.seconds_left() is None
+
+    progress.update(1024 * 1024)
+    progress.file_done()
+
+    assert progress.percent() == 25
+    assert progress.text().startswith("Laster opp: 1 av 2 filer, 1 MB av 4 MB")
+
+def test_resumed_bytes_are_not_counted_as_sent():
+    progress = UploadProgress(4 * 1024 * 1024, 1)
+    progress.add_resumed_bytes(3 * 1024 * 1024)
+
+    progress.update(3 * 1024 * 1024)
+    assert progress.percent() == 75
+    assert progress.seconds_left() is None
+
+    progress._start_time -= 10
+    progress.update(3 * 1024 * 1024 + 512 * 1024)
+
+    # 512 KB sent in 10 seconds, 512 KB left
+    assert 9 < progress.seconds_left() < 11
+
+def test_format_bytes():
+    assert format_bytes(512) == "512 B"
+    assert format_bytes(3 * 1024 ** 3) == "3.0 GB"
@@ -4,7 +4,8 @@ from riogisoffline.plugin.utils import (
     get_plugin_dir,
     load_json,
     get_settings_path,
-    get_user_settings_path
+    get_user_settings_path,
+    get_plugin_version
 )
 
 def test_get_plugin_dir():
@@ -23,3 +24,6 @@ def test_get_user_settings_path():
 def test_load_json():
     path = get_settings_path()
     assert load_json(path)
+
+def test_get_plugin_version():
+    assert get_plugin_version()